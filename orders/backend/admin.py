@@ -1,11 +1,15 @@
 from django.contrib import admin
 
 from django.contrib.auth.admin import UserAdmin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
 # Register your models here.
 
 from backend.models import User, Shop, Category, Order, OrderItem, Product, ProductInfo, Parameter, ProductParameter, \
-    Contact
+    Contact, ImportJob, OutgoingEmail, RequestProfile
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -57,3 +61,48 @@ class ProductParameterAdmin(admin.ModelAdmin):
 @admin.register(Contact)
 class ContactAdmin(admin.ModelAdmin):
     pass
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'url', 'shop', 'state', 'created_at', 'finished_at')
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'state', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('state',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """
+    Профили запросов: сводка по cumulative и скачивание полного профиля
+    """
+    list_display = ('id', 'created_at', 'user', 'method', 'path', 'status', 'duration', 'profiler')
+    list_filter = ('view', 'profiler')
+    exclude = ('data',)
+    readonly_fields = ('user', 'method', 'path', 'view', 'status', 'duration', 'profiler', 'created_at', 'download',
+                       'stats')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:profile_id>/download/', self.admin_site.admin_view(self.download_view),
+                 name='backend_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, obj):
+        return format_html('<a href="{}">{}</a>', reverse('admin:backend_requestprofile_download', args=[obj.id]),
+                           obj.file_name)
+    download.short_description = 'Профиль'
+
+    def download_view(self, request, profile_id):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, id=profile_id)
+        response = HttpResponse(bytes(profile.data), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile.file_name}"'
+        return response
@@ -0,0 +1,110 @@
+"""
+Аутентификация по заголовку token с кэшированием пользователя
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш в памяти процесса с временем жизни записей
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LRUCache(settings.TOKEN_CACHE['MAX_SIZE'], settings.TOKEN_CACHE['LOCAL_TTL'])
+
+
+def shared_cache():
+    return caches[settings.TOKEN_CACHE['CACHE']]
+
+
+def cache_key(key):
+    return f'auth-token:{key}'
+
+
+def get_token_user(key):
+    """
+    Пользователь по ключу токена: сначала локальный кэш, затем общий, затем БД.
+    Удаление токена и изменение пользователя сбрасывают оба кэша этого процесса;
+    в других процессах запись остаётся до LOCAL_TTL секунд, а если кэш CACHE
+    не общий (LocMem) - до SHARED_TTL
+    """
+    user = local_cache.get(key)
+    if user is not None:
+        return user
+
+    user = shared_cache().get(cache_key(key))
+    if user is None:
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None:
+            return None
+        user = token.user
+        shared_cache().set(cache_key(key), user, settings.TOKEN_CACHE['SHARED_TTL'])
+
+    local_cache.set(key, user)
+    return user
+
+
+def invalidate_token(key):
+    local_cache.delete(key)
+    shared_cache().delete(cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(BaseAuthentication):
+    """
+    Аутентификация по заголовку token.
+    Неизвестный токен или неактивный пользователь дают анонимный запрос,
+    ответ в этом случае формирует само представление
+    """
+    def authenticate(self, request):
+        key = request.headers.get('token')
+        if not key:
+            return None
+
+        user = get_token_user(key)
+        if user is None or not user.is_active:
+            return None
+        return user, key
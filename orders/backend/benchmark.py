@@ -0,0 +1,75 @@
+"""
+Синтетические данные и статистика для нагрузочных замеров
+"""
+import math
+import os
+import random
+
+import yaml
+
+
+def make_price_list(size, shop='Связной', categories=10, parameters=4, seed=0):
+    """
+    Прайс-лист в формате PartnerUpdate с size позициями
+    """
+    rnd = random.Random(seed)
+    return {
+        'shop': shop,
+        'categories': [{'id': i + 1, 'name': f'Категория {i + 1}'} for i in range(categories)],
+        'goods': [{
+            'id': i + 1,
+            'category': i % categories + 1,
+            'model': f'vendor/model-{i % 97}',
+            'name': f'Товар {i + 1}',
+            'price': rnd.randint(100, 200000),
+            'price_rrc': rnd.randint(100, 200000),
+            'quantity': rnd.randint(0, 50),
+            'parameters': {f'Параметр {j + 1}': f'Значение {rnd.randint(1, 8)}' for j in range(parameters)},
+        } for i in range(size)],
+    }
+
+
+def make_catalog(shops=3, skus=1000, parameters=4, categories=10, seed=0):
+    """
+    Прайс-листы shops магазинов по skus позиций.
+    Категории и товары у магазинов общие, цены и остатки разные
+    """
+    return [make_price_list(skus, shop=f'Магазин {n + 1}', categories=categories, parameters=parameters,
+                            seed=seed + n) for n in range(shops)]
+
+
+def write_price_lists(directory, price_lists):
+    """
+    Сохраняет прайс-листы в YAML-файлы shop-1.yaml, shop-2.yaml, ... и возвращает их имена
+    """
+    names = []
+    for n, price_list in enumerate(price_lists):
+        name = f'shop-{n + 1}.yaml'
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as file:
+            yaml.safe_dump(price_list, file, allow_unicode=True, sort_keys=False)
+        names.append(name)
+    return names
+
+
+def percentile(values, percent):
+    """
+    Перцентиль отсортированного списка по методу ближайшего ранга
+    """
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)), 1) - 1]
+
+
+def summarize(latencies, errors, seconds):
+    """
+    Пропускная способность и задержки (мс) серии запросов
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 1) if seconds else None,
+        **{name: round(percentile(latencies, percent) * 1000, 2) if latencies else None
+           for name, percent in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+    }
@@ -0,0 +1,107 @@
+"""
+Кэш ответов каталога и условные GET-запросы по версии каталога магазина
+"""
+from calendar import timegm
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Shop
+
+
+def catalog_cache():
+    return caches[settings.CATALOG_CACHE['CACHE']]
+
+
+def version_key(shop_id=None):
+    return f'catalog-version:{shop_id or "all"}'
+
+
+def get_catalog_version(shop_id=None):
+    """
+    Версия каталога магазина или, без shop_id, всего каталога, и время
+    её последнего изменения (unix time или None).
+    Значение кэшируется на VERSION_TIMEOUT секунд, это предел устаревания
+    для процессов, не разделяющих кэш с тем, кто менял каталог
+    """
+    cache = catalog_cache()
+    key = version_key(shop_id)
+    version = cache.get(key)
+    if version is None:
+        if shop_id:
+            shop = Shop.objects.filter(id=shop_id).values('catalog_version', 'catalog_updated_at').first() or {}
+            number, updated_at = shop.get('catalog_version', 0), shop.get('catalog_updated_at')
+        else:
+            totals = Shop.objects.aggregate(version=Sum('catalog_version'), count=Count('id'),
+                                            updated_at=Max('catalog_updated_at'))
+            number, updated_at = f'{totals["version"] or 0}.{totals["count"]}', totals['updated_at']
+        version = (number, timegm(updated_at.utctimetuple()) if updated_at else None)
+        cache.set(key, version, settings.CATALOG_CACHE['VERSION_TIMEOUT'])
+    return version
+
+
+def bump_catalog_version(shop_ids=None):
+    """
+    Увеличивает версию каталога магазинов, без shop_ids - всех магазинов
+    """
+    shops = Shop.objects.all() if shop_ids is None else Shop.objects.filter(id__in=shop_ids)
+    ids = list(shops.values_list('id', flat=True))
+    Shop.objects.filter(id__in=ids).update(catalog_version=F('catalog_version') + 1,
+                                           catalog_updated_at=timezone.now())
+
+    keys = [version_key()] + [version_key(shop_id) for shop_id in ids]
+    transaction.on_commit(lambda: catalog_cache().delete_many(keys))
+
+
+class CatalogState:
+    """
+    Версия каталога для запроса: ETag, Last-Modified и ключ кэша ответа.
+    Всё вычисляется без обращения к БД, пока версия есть в кэше
+    """
+    def __init__(self, request, shop_id=None):
+        if not (shop_id and str(shop_id).isdigit()):
+            shop_id = None
+        self.shop_id = shop_id
+        self.version, self.last_modified = get_catalog_version(shop_id)
+
+        # the body has absolute Next/Previous links, so the scheme and host are part of the key
+        params = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values))
+        url = f'{request.scheme}://{request.get_host()}{request.path}?{params}'
+        self.digest = md5(f'{self.version}:{url}'.encode()).hexdigest()
+        self.etag = f'"{self.digest}"'
+
+    @property
+    def response_key(self):
+        return f'catalog-response:{self.shop_id or "all"}:{self.digest}'
+
+    def not_modified(self, request):
+        """
+        Ответ 304, если у клиента актуальная версия
+        """
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def add_headers(self, response):
+        if response.status_code == 200:
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+    def get_cached_response(self):
+        content = catalog_cache().get(self.response_key)
+        if content is None:
+            return None
+        return self.add_headers(HttpResponse(content, content_type='application/json'))
+
+    def cache_response(self, response):
+        if response.status_code == 200:
+            catalog_cache().set(self.response_key, response.content, settings.CATALOG_CACHE['TIMEOUT'])
+        return self.add_headers(response)
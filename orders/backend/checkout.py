@@ -0,0 +1,146 @@
+"""
+Оформление заказа с резервированием остатков
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .cache import bump_catalog_version
+from .models import Order, OrderItem, ProductInfo
+from .signals import new_order
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def get_basket(user):
+    basket, _ = Order.objects.get_or_create(user=user, status='basket')
+    return basket
+
+
+def get_offers(pairs):
+    """
+    {(product_id, shop_id): id ProductInfo} для магазинов, принимающих заказы.
+    Предложение выбирается так же, как в offer_price()
+    """
+    if not pairs:
+        return {}
+    offers = {}
+    for product_info_id, product_id, shop_id in ProductInfo.objects.filter(
+            product_id__in={product_id for product_id, _ in pairs},
+            shop_id__in={shop_id for _, shop_id in pairs},
+            shop__state=True).offers().values_list('id', 'product_id', 'shop_id'):
+        offers.setdefault((product_id, shop_id), product_info_id)
+    return offers
+
+
+def update_basket(basket, items):
+    """
+    Задаёт количество сразу для многих товаров корзины.
+    items - список {'product_info': id, 'quantity': количество}; существующие
+    позиции обновляются, новые добавляются. Повтор product_info в одном
+    пакете считается ошибкой строки. Число запросов не зависит от
+    числа позиций. Возвращает результат по каждой строке
+    """
+    results, lines = [], {}
+    for item in items:
+        try:
+            product_info_id, quantity = int(item['product_info']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            results.append({'product_info': item.get('product_info') if isinstance(item, dict) else None,
+                            'Status': False, 'Error': 'product_info and quantity must be integers'})
+            continue
+        if quantity <= 0:
+            results.append({'product_info': product_info_id, 'Status': False, 'Error': 'Quantity must be positive'})
+            continue
+        if product_info_id in lines:
+            results.append({'product_info': product_info_id, 'Status': False,
+                            'Error': 'Duplicate product_info in the batch'})
+            continue
+        result = {'product_info': product_info_id}
+        results.append(result)
+        lines[product_info_id] = (quantity, result)
+
+    offers = {
+        product_info_id: (product_id, shop_id)
+        for product_info_id, product_id, shop_id in ProductInfo.objects.filter(
+            id__in=lines, shop__state=True).values_list('id', 'product_id', 'shop_id')
+    }
+    existing = dict(basket.ordered_items.filter(product_info_id__in=offers).values_list('product_info_id', 'id'))
+
+    created, updated = [], []
+    for product_info_id, (quantity, result) in lines.items():
+        pair = offers.get(product_info_id)
+        if pair is None:
+            result.update({'Status': False, 'Error': 'Product not found'})
+        elif product_info_id in existing:
+            updated.append(OrderItem(id=existing[product_info_id], quantity=quantity))
+            result.update({'Status': True, 'Created': False})
+        else:
+            created.append(OrderItem(order=basket, product_info_id=product_info_id, product_id=pair[0],
+                                     shop_id=pair[1], quantity=quantity))
+            result.update({'Status': True, 'Created': True})
+
+    with transaction.atomic():
+        if updated:
+            OrderItem.objects.bulk_update(updated, ['quantity'])
+        if created:
+            OrderItem.objects.bulk_create(created)
+    return results
+
+
+def checkout(order):
+    """
+    Переводит корзину в статус new и списывает остатки.
+
+    Остатки резервируются одним условным UPDATE: количество уменьшается,
+    только если его хватает для всех позиций, иначе транзакция откатывается.
+    Поэтому параллельные заказы не могут продать одну единицу товара дважды.
+    Письмо о заказе ставится в очередь в той же транзакции.
+    Списывается предложение, выбранное покупателем; если его позиция
+    удалена импортом, берётся текущее предложение товара в магазине и
+    запоминается в позиции заказа, чтобы цена считалась по нему же.
+    Число запросов не зависит от числа позиций
+    """
+    items = list(order.ordered_items.values_list('id', 'product_info_id', 'product_id', 'shop_id', 'quantity'))
+    if not items:
+        raise CheckoutError('Basket is empty')
+
+    chosen = {product_info_id for _, product_info_id, _, _, _ in items if product_info_id is not None}
+    available = set(ProductInfo.objects.filter(id__in=chosen, shop__state=True).values_list(
+        'id', flat=True)) if chosen else set()
+    offers = get_offers({(product_id, shop_id) for _, product_info_id, product_id, shop_id, _ in items
+                         if product_info_id is None})
+
+    reserve, pinned = {}, []
+    for item_id, product_info_id, product_id, shop_id, quantity in items:
+        if product_info_id is None:
+            product_info_id = offers.get((product_id, shop_id))
+            if product_info_id is not None:
+                pinned.append(OrderItem(id=item_id, product_info_id=product_info_id))
+        elif product_info_id not in available:
+            product_info_id = None
+        if product_info_id is None:
+            raise CheckoutError('Some products are no longer available')
+        reserve[product_info_id] = reserve.get(product_info_id, 0) + quantity
+    amount = Case(*[When(id=product_info_id, then=Value(quantity)) for product_info_id, quantity in reserve.items()],
+                  output_field=IntegerField())
+
+    # writes only: the transaction takes the write lock with its first statement
+    with transaction.atomic():
+        if not Order.objects.filter(id=order.id, status='basket').update(status='new'):
+            raise CheckoutError('Order is already placed')
+        reserved = ProductInfo.objects.filter(id__in=reserve, quantity__gte=amount).update(
+            quantity=F('quantity') - amount)
+        if reserved != len(reserve):
+            raise CheckoutError('Not enough products in stock')
+        if pinned:
+            OrderItem.objects.bulk_update(pinned, ['product_info'])
+        # stock is part of the cached catalog responses; bumping after commit
+        # keeps the shop rows out of the reservation, so checkouts don't queue on them
+        shop_ids = {shop_id for _, _, _, shop_id, _ in items}
+        transaction.on_commit(lambda: bump_catalog_version(shop_ids))
+        new_order.send(sender=Order, user_id=order.user_id)
+
+    order.status = 'new'
+    return order
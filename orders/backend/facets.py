@@ -0,0 +1,68 @@
+"""
+Фильтры по параметрам товаров и счётчики их значений
+"""
+import re
+
+from django.db.models import Count, Sum
+
+from .models import ParameterFacet, ProductParameter
+
+PARAMETER_FILTER = re.compile(r'^param\[(.+)\]$')
+
+
+def refresh_facets(shop):
+    """
+    Пересчитывает счётчики значений параметров по всем категориям магазина
+    """
+    ParameterFacet.objects.filter(shop=shop).delete()
+    counts = ProductParameter.objects.filter(product_info__shop=shop).values(
+        'product_info__product__category_id', 'parameter_id', 'value').annotate(count=Count('id')).order_by()
+    ParameterFacet.objects.bulk_create([
+        ParameterFacet(shop=shop, category_id=row['product_info__product__category_id'],
+                       parameter_id=row['parameter_id'], value=row['value'], count=row['count'])
+        for row in counts
+    ], batch_size=1000)
+
+
+def parse_parameter_filters(query_params):
+    """
+    {название параметра: [значения]} из аргументов вида param[Цвет]=синий
+    """
+    filters = {}
+    for key, values in query_params.lists():
+        match = PARAMETER_FILTER.match(key)
+        if match:
+            filters[match.group(1)] = values
+    return filters
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Предложения, у которых каждый параметр принимает одно из переданных значений
+    """
+    for name, values in filters.items():
+        queryset = queryset.filter(product_parameters__parameter__name=name, product_parameters__value__in=values)
+    return queryset
+
+
+def get_facets(shop_id=None, category_id=None, queryset=None):
+    """
+    {параметр: {значение: число предложений}}.
+    Без фильтров по параметрам счётчики берутся из ParameterFacet,
+    иначе считаются только по отобранным предложениям из queryset
+    """
+    if queryset is None:
+        rows = ParameterFacet.objects.filter(shop__state=True)
+        if shop_id:
+            rows = rows.filter(shop_id=shop_id)
+        if category_id:
+            rows = rows.filter(category_id=category_id)
+        rows = rows.values_list('parameter__name', 'value').annotate(total=Sum('count'))
+    else:
+        rows = ProductParameter.objects.filter(product_info__in=queryset.values('id')).values_list(
+            'parameter__name', 'value').annotate(total=Count('product_info_id', distinct=True))
+
+    facets = {}
+    for name, value, total in rows.order_by('parameter__name', 'value'):
+        facets.setdefault(name, {})[value] = total
+    return facets
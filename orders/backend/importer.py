@@ -0,0 +1,264 @@
+"""
+Импорт прайс-листов поставщиков
+"""
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+
+from .cache import bump_catalog_version
+from .facets import refresh_facets
+from .search import index_product_infos, remove_product_infos
+from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+
+BATCH_SIZE = 500
+
+PRODUCT_INFO_FIELDS = ('product_id', 'model', 'name', 'quantity', 'price', 'price_rrc')
+
+UPDATED_FIELDS = PRODUCT_INFO_FIELDS + ('parameters', )
+
+
+def batched(iterable, size):
+    """
+    Разбивает итерируемый объект на списки длиной не более size
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CatalogImporter:
+    """
+    Загрузка каталога магазина пачками.
+
+    Ключи категорий, продуктов и параметров читаются в память один раз,
+    недостающие создаются через bulk_create, поэтому число запросов
+    зависит от количества пачек, а не от количества строк.
+    Позиции сопоставляются с существующими по (shop, external_id):
+    новые добавляются, изменившиеся обновляются, остальные не трогаются.
+    """
+    def __init__(self, shop, batch_size=BATCH_SIZE, progress=None):
+        self.shop = shop
+        self.batch_size = batch_size
+        self.progress = progress
+        self.categories = dict(Category.objects.values_list('id', 'name'))
+        self.products = {
+            (name, category_id): product_id
+            for product_id, name, category_id in Product.objects.values_list('id', 'name', 'category_id')
+        }
+        self.parameters = {name: parameter_id for parameter_id, name in Parameter.objects.values_list('id', 'name')}
+        self.seen = set()
+        self.categories_created = False
+        self.categories_renamed = False
+        self.stats = {'categories': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    def import_categories(self, categories):
+        new, renamed, ids = [], [], []
+        for category in categories:
+            category_id, name = category['id'], category['name']
+            if category_id not in self.categories:
+                new.append(Category(id=category_id, name=name))
+            elif self.categories[category_id] != name:
+                renamed.append(Category(id=category_id, name=name))
+            self.categories[category_id] = name
+            ids.append(category_id)
+
+        if new:
+            Category.objects.bulk_create(new, batch_size=self.batch_size)
+            self.categories_created = True
+        if renamed:
+            Category.objects.bulk_update(renamed, ['name'], batch_size=self.batch_size)
+            self.categories_renamed = True
+        if ids:
+            self.shop.categories.add(*ids)
+        self.stats['categories'] += len(ids)
+
+    def clear(self):
+        """
+        Удаляет текущий каталог магазина
+        """
+        for ids in batched(ProductInfo.objects.filter(shop_id=self.shop.id).values_list('id', flat=True),
+                           self.batch_size):
+            remove_product_infos(ids)
+        _, deleted = ProductInfo.objects.filter(shop_id=self.shop.id).delete()
+        self.stats['deleted'] += deleted.get(ProductInfo._meta.label, 0)
+
+    def import_goods(self, goods):
+        for batch in batched(goods, self.batch_size):
+            self._import_batch(batch)
+            if self.progress is not None:
+                self.progress(self)
+
+    def _resolve_products(self, items):
+        missing = {}
+        for item in items:
+            key = (item['name'], item['category'])
+            if key not in self.products:
+                missing[key] = Product(name=item['name'], category_id=item['category'])
+        if not missing:
+            return
+
+        Product.objects.bulk_create(missing.values(), batch_size=self.batch_size)
+        names = {name for name, _ in missing}
+        for product_id, name, category_id in Product.objects.filter(name__in=names).values_list(
+                'id', 'name', 'category_id'):
+            self.products.setdefault((name, category_id), product_id)
+
+    def _resolve_parameters(self, items):
+        missing = {name for item in items for name in item['parameters'] if name not in self.parameters}
+        if not missing:
+            return
+
+        Parameter.objects.bulk_create([Parameter(name=name) for name in missing], batch_size=self.batch_size)
+        for parameter_id, name in Parameter.objects.filter(name__in=missing).values_list('id', 'name'):
+            self.parameters.setdefault(name, parameter_id)
+
+    def _import_batch(self, items):
+        # a later row with the same external id wins
+        items = list({item['id']: item for item in items}.values())
+        self._resolve_products(items)
+        self._resolve_parameters(items)
+
+        existing = {
+            row['external_id']: row
+            for row in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[item['id'] for item in items]).values('id', 'external_id', *PRODUCT_INFO_FIELDS)
+        }
+        existing_parameters = {}
+        if existing:
+            for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                    product_info_id__in=[row['id'] for row in existing.values()]).values_list(
+                    'product_info_id', 'parameter_id', 'value'):
+                existing_parameters.setdefault(product_info_id, {})[parameter_id] = value
+
+        created, changed, reparametrized = [], [], []
+        parameters = {}
+        for item in items:
+            fields = {
+                'product_id': self.products[(item['name'], item['category'])],
+                'external_id': item['id'],
+                'model': item['model'],
+                'name': item['name'],
+                'quantity': item['quantity'],
+                'price': item['price'],
+                'price_rrc': item['price_rrc'],
+            }
+            parameters[item['id']] = {self.parameters[name]: str(value) for name, value in item['parameters'].items()}
+            fields['parameters'] = [[name, str(value)] for name, value in item['parameters'].items()]
+            self.seen.add(item['id'])
+
+            row = existing.get(item['id'])
+            if row is None:
+                created.append(ProductInfo(shop_id=self.shop.id, **fields))
+                continue
+
+            fields_changed = any(row[field] != fields[field] for field in PRODUCT_INFO_FIELDS)
+            parameters_changed = existing_parameters.get(row['id'], {}) != parameters[item['id']]
+            if parameters_changed:
+                reparametrized.append(item['id'])
+            if fields_changed or parameters_changed:
+                changed.append(ProductInfo(id=row['id'], shop_id=self.shop.id, **fields))
+                self.stats['updated'] += 1
+            else:
+                self.stats['unchanged'] += 1
+
+        if changed:
+            ProductInfo.objects.bulk_update(changed, UPDATED_FIELDS, batch_size=self.batch_size)
+        if reparametrized:
+            ProductParameter.objects.filter(
+                product_info_id__in=[existing[external_id]['id'] for external_id in reparametrized]).delete()
+        if created:
+            ProductInfo.objects.bulk_create(created, batch_size=self.batch_size)
+            self.stats['inserted'] += len(created)
+
+        ids = {external_id: row['id'] for external_id, row in existing.items()}
+        if created:
+            # bulk_create doesn't return primary keys on every backend
+            ids.update(ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[obj.external_id for obj in created]).values_list(
+                'external_id', 'id'))
+
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info_id=ids[external_id], parameter_id=parameter_id, value=value)
+            for external_id in [obj.external_id for obj in created] + reparametrized
+            for parameter_id, value in parameters[external_id].items()
+        ], batch_size=self.batch_size)
+
+        index_product_infos([ids[obj.external_id] for obj in created + changed])
+
+    def delete_missing(self):
+        """
+        Удаляет позиции, которых не было в прайс-листе
+        """
+        missing = [
+            product_info_id
+            for product_info_id, external_id in ProductInfo.objects.filter(shop_id=self.shop.id).values_list(
+                'id', 'external_id')
+            if external_id not in self.seen
+        ]
+        for ids in batched(missing, self.batch_size):
+            remove_product_infos(ids)
+            ProductInfo.objects.filter(id__in=ids).delete()
+        self.stats['deleted'] += len(missing)
+
+
+def iter_entries(data):
+    """
+    Представляет уже разобранный прайс-лист в виде пар (раздел, значение)
+    """
+    yield 'shop', data['shop']
+    for category in data['categories']:
+        yield 'categories', category
+    for item in data['goods']:
+        yield 'goods', item
+
+
+def import_entries(entries, replace=False, batch_size=BATCH_SIZE, progress=None):
+    """
+    Загружает прайс-лист из потока пар (раздел, значение) в одной транзакции
+    и возвращает сводку изменений. Позиции обрабатываются пачками по мере
+    чтения. При replace=True каталог магазина предварительно удаляется целиком.
+    progress вызывается с импортером после каждой пачки и по завершении
+    """
+    importer = None
+    with transaction.atomic():
+        for section, rows in groupby(entries, key=itemgetter(0)):
+            values = (value for _, value in rows)
+            if section == 'shop':
+                shop, _ = Shop.objects.get_or_create(name=next(values))
+                importer = CatalogImporter(shop, batch_size=batch_size, progress=progress)
+                if replace:
+                    importer.clear()
+            elif importer is None:
+                raise ValueError('Price list must start with the shop name')
+            elif section == 'categories':
+                importer.import_categories(values)
+            elif section == 'goods':
+                importer.import_goods(values)
+
+        if importer is None:
+            raise ValueError('Price list must start with the shop name')
+        importer.delete_missing()
+        goods_changed = any(importer.stats[counter] for counter in ('inserted', 'updated', 'deleted'))
+        if goods_changed:
+            refresh_facets(importer.shop)
+        if importer.categories_renamed:
+            # category names are shown in every shop's catalog
+            bump_catalog_version()
+        elif goods_changed or importer.categories_created:
+            bump_catalog_version([importer.shop.id])
+        if progress is not None:
+            progress(importer)
+    return importer.stats
+
+
+def import_price_list(data, replace=False, batch_size=BATCH_SIZE):
+    """
+    Загружает уже разобранный прайс-лист
+    """
+    return import_entries(iter_entries(data), replace=replace, batch_size=batch_size)
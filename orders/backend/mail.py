@@ -0,0 +1,92 @@
+"""
+Очередь исходящих писем.
+
+Письма записываются в OutgoingEmail в транзакции запроса и отправляются
+командой send_queued_emails, поэтому недоступность почтового сервера не
+влияет ни на время ответа, ни на результат запроса
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to, from_email=None):
+    """
+    Ставит письмо в очередь. Вызывается внутри транзакции запроса:
+    при её откате письмо не будет отправлено
+    """
+    return OutgoingEmail.objects.create(subject=subject, body=body, to=list(to),
+                                        from_email=from_email or settings.EMAIL_HOST_USER)
+
+
+def retry_delay(attempts):
+    options = settings.EMAIL_OUTBOX
+    return timedelta(seconds=min(options['BACKOFF'] * 2 ** (attempts - 1), options['MAX_BACKOFF']))
+
+
+def claim_emails(batch_size):
+    """
+    Забирает письма, которым пора отправляться. Время следующей попытки
+    сдвигается на LEASE, так что параллельные обработчики не возьмут
+    те же письма, а письма упавшего обработчика вернутся в очередь
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.EMAIL_OUTBOX['LEASE'])
+    due = OutgoingEmail.objects.filter(state='queued', next_attempt_at__lte=now).order_by(
+        'next_attempt_at', 'id').values_list('id', 'next_attempt_at')[:batch_size]
+    claimed = [email_id for email_id, next_attempt_at in due
+               if OutgoingEmail.objects.filter(id=email_id, next_attempt_at=next_attempt_at).update(
+                   next_attempt_at=lease)]
+    return list(OutgoingEmail.objects.filter(id__in=claimed).order_by('id'))
+
+
+def send_queued_emails(batch_size=None):
+    """
+    Отправляет одну пачку писем через одно соединение с почтовым сервером.
+    Неотправленные письма повторяются с экспоненциальной задержкой, после
+    MAX_ATTEMPTS попыток получают статус failed.
+    Возвращает (отправлено, ошибок)
+    """
+    emails = claim_emails(batch_size or settings.EMAIL_OUTBOX['BATCH_SIZE'])
+    if not emails:
+        return 0, 0
+
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        failed = [(email, error) for email in emails]
+    else:
+        try:
+            for email in emails:
+                message = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.to,
+                                                 connection=connection)
+                # one message per call: a rejected recipient fails only its own email
+                try:
+                    connection.send_messages([message])
+                except Exception as error:
+                    failed.append((email, error))
+                else:
+                    sent.append(email.id)
+        finally:
+            connection.close()
+
+    now = timezone.now()
+    OutgoingEmail.objects.filter(id__in=sent).update(state='sent', sent_at=now, error='')
+    for email, error in failed:
+        attempts = email.attempts + 1
+        logger.warning('Email %s failed (attempt %s): %s', email.id, attempts, error)
+        if attempts >= settings.EMAIL_OUTBOX['MAX_ATTEMPTS']:
+            changes = {'state': 'failed'}
+        else:
+            changes = {'next_attempt_at': now + retry_delay(attempts)}
+        OutgoingEmail.objects.filter(id=email.id).update(attempts=attempts, error=str(error), **changes)
+    return len(sent), len(failed)
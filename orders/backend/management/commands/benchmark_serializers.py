@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.http import JsonResponse
+
+from backend.benchmark import make_price_list
+from backend.importer import import_price_list
+from backend.models import ProductInfo
+from backend.serializers import ProductInfoSerializer, ProductInfoReadSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает ProductInfoSerializer и ProductInfoReadSerializer на синтетическом каталоге. ' \
+           'Данные создаются в транзакции, которая затем откатывается'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def measure(self, func, repeat):
+        best, content = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = JsonResponse({'Status': True, 'Data': func()}).content
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"rows":>8} {"model, s":>10} {"read, s":>10} {"speedup":>8}')
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    import_price_list(make_price_list(size, shop='benchmark'))
+                    queryset = ProductInfo.objects.filter(shop__name='benchmark').order_by('id')
+
+                    model_time, model_content = self.measure(
+                        lambda: ProductInfoSerializer(queryset.for_catalog(), many=True).data, options['repeat'])
+                    read_time, read_content = self.measure(
+                        lambda: ProductInfoReadSerializer(queryset).data, options['repeat'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+            if model_content != read_content:
+                raise CommandError(f'Serializers output differs at {size} rows')
+            self.stdout.write(f'{size:>8} {model_time:>10.3f} {read_time:>10.3f} {model_time / read_time:>7.1f}x')
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.importer import batched
+from backend.models import ProductInfo, ProductParameter
+
+
+class Command(BaseCommand):
+    help = 'Сверяет ProductInfo.parameters с таблицей ProductParameter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Перезаписать расходящиеся значения')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        for chunk in batched(ids, options['batch_size']):
+            expected = {product_info_id: [] for product_info_id in chunk}
+            for product_info_id, name, value in ProductParameter.objects.filter(
+                    product_info_id__in=chunk).order_by('id').values_list('product_info_id', 'parameter__name', 'value'):
+                expected[product_info_id].append([name, value])
+
+            broken = [
+                ProductInfo(id=product_info_id, parameters=expected[product_info_id])
+                for product_info_id, parameters in ProductInfo.objects.filter(id__in=chunk).values_list(
+                    'id', 'parameters')
+                if parameters != expected[product_info_id]
+            ]
+            for product_info in broken:
+                self.stdout.write(f'ProductInfo {product_info.id}: parameters are out of sync')
+            if broken and options['fix']:
+                ProductInfo.objects.bulk_update(broken, ['parameters'])
+            mismatched += len(broken)
+
+        if mismatched and not options['fix']:
+            raise CommandError(f'{mismatched} of {len(ids)} products are out of sync, run with --fix')
+        self.stdout.write(self.style.SUCCESS(f'Checked {len(ids)} products, fixed {mismatched}'
+                                             if options['fix'] else f'Checked {len(ids)} products'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.tasks import claim_next_job, run_import_job
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания на загрузку прайс-листов из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать текущую очередь и завершиться')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между проверками очереди, секунды')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            job = run_import_job(job)
+            if job.state == 'done':
+                self.stdout.write(self.style.SUCCESS(
+                    f'Job {job.id}: +{job.inserted} ~{job.updated} -{job.deleted} ={job.unchanged}'))
+            elif job.state == 'unchanged':
+                self.stdout.write(f'Job {job.id}: price list is unchanged')
+            else:
+                self.stderr.write(f'Job {job.id} failed: {job.error}')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.importer import batched
+from backend.models import ProductInfo
+from backend.search import index_product_infos
+
+
+class Command(BaseCommand):
+    help = 'Заново строит поисковый индекс товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = 0
+        with transaction.atomic():
+            for ids in batched(list(ProductInfo.objects.values_list('id', flat=True)), options['batch_size']):
+                index_product_infos(ids)
+                count += len(ids)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
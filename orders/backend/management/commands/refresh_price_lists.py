@@ -0,0 +1,123 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import Shop
+from backend.pricelist import iter_parsed_price_list, parse_price_list
+from backend.tasks import download_feed, get_feed_shop, import_feed, is_feed_unchanged
+
+
+def parse(path):
+    """
+    Разбор в процессе пула; время меряется здесь, а не при получении результата
+    """
+    started = time.monotonic()
+    parsed = parse_price_list(path)
+    return parsed, time.monotonic() - started
+
+
+class Command(BaseCommand):
+    help = 'Параллельно обновляет прайс-листы нескольких магазинов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*',
+                            help='Id или названия магазинов либо ссылки на прайс-листы. '
+                                 'По умолчанию все магазины с заполненной ссылкой')
+        parser.add_argument('--fetch-workers', type=int, default=8, help='Число параллельных загрузок')
+        parser.add_argument('--parse-workers', type=int, default=os.cpu_count(), help='Число процессов разбора')
+        parser.add_argument('--timeout', type=float, default=None, help='Таймаут запроса, секунды')
+        parser.add_argument('--replace', action='store_true', help='Полностью заменить каталоги магазинов')
+
+    def get_urls(self, targets):
+        if not targets:
+            return list(Shop.objects.exclude(url__isnull=True).exclude(url='').values_list('url', flat=True))
+
+        urls = []
+        for target in targets:
+            if '://' in target:
+                urls.append(target)
+                continue
+            shop = Shop.objects.filter(id=target).first() if target.isdigit() else None
+            shop = shop or Shop.objects.filter(name=target).first()
+            if shop is None or not shop.url:
+                raise CommandError(f'Shop "{target}" not found or has no url')
+            urls.append(shop.url)
+        return urls
+
+    def downloaded(self, url, future, shop, item):
+        """
+        Загрузка, которую нужно разобрать, или None
+        """
+        try:
+            download = future.result()
+        except Exception as e:
+            item['error'] = str(e)
+            self.stderr.write(f'{url}: download failed: {e}')
+            return None
+        if is_feed_unchanged(download, shop):
+            item['unchanged'] = True
+            self.stdout.write(f'{url}: unchanged')
+            if download.path:
+                os.remove(download.path)
+            return None
+        return download
+
+    def import_parsed(self, url, future, download, item, replace):
+        # database writes happen here, one price list at a time
+        parsed = None
+        try:
+            parsed, item['parse'] = future.result()
+            import_started = time.monotonic()
+            item['stats'] = import_feed(url, iter_parsed_price_list(parsed), download, replace=replace)
+            item['import'] = time.monotonic() - import_started
+        except Exception as e:
+            item['error'] = str(e)
+            self.stderr.write(f'{url}: import failed: {e}')
+        else:
+            self.stdout.write(f'{url}: done')
+        finally:
+            os.remove(download.path)
+            if parsed:
+                os.remove(parsed)
+
+    def handle(self, *args, **options):
+        urls = list(dict.fromkeys(self.get_urls(options['targets'])))
+        shops = {url: None if options['replace'] else get_feed_shop(url) for url in urls}
+        report = {url: {} for url in urls}
+        started = time.monotonic()
+
+        def fetch(url):
+            fetch_started = time.monotonic()
+            download = download_feed(url, shops[url], timeout=options['timeout'])
+            report[url]['fetch'] = time.monotonic() - fetch_started
+            return download
+
+        # each feed moves on as soon as its previous stage is done: downloads and
+        # parsing keep running in the pools while this thread imports
+        with ThreadPoolExecutor(max_workers=options['fetch_workers']) as fetch_pool, \
+                ProcessPoolExecutor(max_workers=options['parse_workers']) as parse_pool:
+            pending = {fetch_pool.submit(fetch, url): (url, None) for url in urls}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, download = pending.pop(future)
+                    if download is None:
+                        download = self.downloaded(url, future, shops[url], report[url])
+                        if download is not None:
+                            pending[parse_pool.submit(parse, download.path)] = (url, download)
+                    else:
+                        self.import_parsed(url, future, download, report[url], options['replace'])
+
+        self.stdout.write('')
+        for url, item in report.items():
+            timings = ' '.join(f'{stage}={item[stage]:.2f}s' for stage in ('fetch', 'parse', 'import') if stage in item)
+            if 'error' in item:
+                result = item['error']
+            elif item.get('unchanged'):
+                result = 'unchanged'
+            else:
+                result = ' '.join(f'{key}={value}' for key, value in item['stats'].items())
+            self.stdout.write(f'{url}: {timings} {result}')
+        self.stdout.write(f'Total: {time.monotonic() - started:.2f}s')
@@ -0,0 +1,189 @@
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle, islice
+from tempfile import TemporaryDirectory
+from threading import Thread, local
+
+import requests
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from backend.benchmark import make_catalog, summarize, write_price_lists
+from backend.importer import import_price_list
+from backend.models import Category, Shop, User
+from backend.tasks import claim_next_job, run_import_job
+
+ENDPOINTS = ('categories', 'products/list', 'product/info', 'partner/update')
+# p95 latency budgets in ms for --check-budgets, set for the default load
+BUDGETS = {'categories': 200, 'products/list': 500, 'product/info': 500, 'partner/update': 500}
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный замер API на синтетическом каталоге: импорт прайс-листов и параллельные ' \
+           'запросы к локальному серверу. Выполняется на отдельной тестовой БД, результат выводится в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=3, help='Число магазинов')
+        parser.add_argument('--skus', type=int, default=1000, help='Позиций в прайс-листе магазина')
+        parser.add_argument('--parameters', type=int, default=4, help='Параметров у позиции')
+        parser.add_argument('--categories', type=int, default=10, help='Число категорий')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clients', type=int, default=8, help='Число параллельных клиентов')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов к каждому адресу')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--process-jobs', action='store_true',
+                            help='Выполнить поставленные partner/update загрузки и замерить их')
+        parser.add_argument('--output', help='Файл для результата, по умолчанию stdout')
+        parser.add_argument('--check-budgets', action='store_true',
+                            help='Завершиться с ошибкой, если p95 адреса выше бюджета из BUDGETS')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['127.0.0.1']):
+                result = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+        if options['check_budgets']:
+            over = [f'{name}: p95 {stats["p95"]}ms > {BUDGETS[name]}ms'
+                    for name, stats in result['endpoints'].items()
+                    if stats['p95'] is not None and stats['p95'] > BUDGETS[name]]
+            if over:
+                raise CommandError('Over budget: ' + '; '.join(over))
+
+    def run(self, options):
+        for cache in caches.all():
+            cache.clear()
+        price_lists = make_catalog(options['shops'], options['skus'], options['parameters'],
+                                   options['categories'], options['seed'])
+        result = {
+            'commit': self.get_commit(),
+            'config': {key: options[key] for key in ('shops', 'skus', 'parameters', 'categories', 'seed',
+                                                     'clients', 'requests')},
+        }
+
+        started = time.perf_counter()
+        for price_list in price_lists:
+            import_price_list(price_list)
+        seconds = time.perf_counter() - started
+        result['import'] = {'rows': options['shops'] * options['skus'], 'seconds': round(seconds, 3),
+                            'rows_per_second': round(options['shops'] * options['skus'] / seconds, 1)}
+
+        with TemporaryDirectory() as directory:
+            feed_server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietFileHandler, directory=directory))
+            api_server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+            api_server.set_app(get_wsgi_application())
+            try:
+                feed_url = serve(feed_server)
+                feeds = [f'{feed_url}/{name}' for name in write_price_lists(directory, price_lists)]
+                plans = self.get_plans(serve(api_server), feeds)
+                result['endpoints'] = {name: self.drive(plans[name], options['clients'], options['requests'])
+                                       for name in options['endpoints']}
+                if options['process_jobs']:
+                    result['jobs'] = self.process_jobs()
+            finally:
+                for server in (api_server, feed_server):
+                    server.shutdown()
+                    server.server_close()
+        return result
+
+    def get_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def get_plans(self, base_url, feeds):
+        """
+        Запросы к каждому адресу: (метод, url, аргументы requests), перебираются по кругу
+        """
+        buyer = User.objects.create_user('buyer@example.com', 'password', username='buyer')
+        buyer_token = Token.objects.create(user=buyer).key
+        shop_tokens = []
+        for n in range(len(feeds)):
+            user = User.objects.create_user(f'shop{n}@example.com', 'password', username=f'shop{n}', type='shop')
+            shop_tokens.append(Token.objects.create(user=user).key)
+
+        shop_ids = list(Shop.objects.order_by('id').values_list('id', flat=True))
+        category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+        return {
+            'categories': [('get', f'{base_url}/categories', {})],
+            'products/list': [
+                ('get', f'{base_url}/products/list', {'params': {'page_size': 50, 'ordering': ordering},
+                                                      'headers': {'token': buyer_token}})
+                for ordering in ('id', 'price', '-price')
+            ],
+            'product/info': [
+                ('get', f'{base_url}/product/info', {'params': {
+                    'shop_id': shop_id, 'category_id': category_id, 'param[Параметр 1]': f'Значение {value}'}})
+                for shop_id in shop_ids for category_id in category_ids for value in (1, 2)
+            ],
+            'partner/update': [
+                ('post', f'{base_url}/partner/update', {'data': {'url': feed}, 'headers': {'token': token}})
+                for feed, token in zip(feeds, shop_tokens)
+            ],
+        }
+
+    def drive(self, plan, clients, count):
+        sessions = local()
+
+        def call(request):
+            method, url, kwargs = request
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                ok = sessions.session.request(method, url, timeout=60, **kwargs).status_code < 400
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(call, islice(cycle(plan), count)))
+        seconds = time.perf_counter() - started
+        return summarize([latency for latency, _ in results], sum(not ok for _, ok in results), seconds)
+
+    def process_jobs(self):
+        states, started = {}, time.perf_counter()
+        job = claim_next_job()
+        while job is not None:
+            job = run_import_job(job)
+            states[job.state] = states.get(job.state, 0) + 1
+            job = claim_next_job()
+        return {'seconds': round(time.perf_counter() - started, 3), 'states': states}
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди исходящей почты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить текущую очередь и завершиться')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между проверками очереди, секунды')
+        parser.add_argument('--batch-size', type=int, default=None, help='Писем на одно соединение')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
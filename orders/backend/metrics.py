@@ -0,0 +1,193 @@
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Каждый процесс копит значения в памяти и не чаще раза в FLUSH_INTERVAL
+секунд сохраняет их в свой файл в каталоге METRICS['DIRECTORY'];
+/metrics складывает файлы всех процессов, так что при нескольких
+воркерах gunicorn счётчики не теряются. Каталог стоит очищать при
+развёртывании. Без DIRECTORY отдаются метрики только текущего процесса
+"""
+import atexit
+import glob
+import json
+import os
+import time
+import uuid
+from threading import Lock, get_ident
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+IMPORT_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by URL name', LATENCY_BUCKETS),
+    'http_responses_total': ('counter', 'Responses by URL name and status code', None),
+    'price_import_duration_seconds': ('histogram', 'Price list import duration', IMPORT_BUCKETS),
+    'price_import_last_duration_seconds': ('gauge', 'Duration of the last price list import of a shop', None),
+    'price_import_rows_per_second': ('gauge', 'Rows per second of the last price list import of a shop', None),
+    'price_import_rows_total': ('counter', 'Imported price list rows by shop and result', None),
+    'price_import_jobs_total': ('counter', 'Finished import jobs by state', None),
+}
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Registry:
+    """
+    Метрики одного процесса
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.pid = os.getpid()
+            self.file_name = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+            self.counters, self.histograms, self.gauges = {}, {}, {}
+            self.flushed_at = time.monotonic()
+
+    def check_fork(self):
+        # a forked worker must not report the parent's values a second time
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        self.check_fork()
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        self.check_fork()
+        key = (name, label_key(labels))
+        buckets = METRICS[name][2]
+        with self.lock:
+            counts, total, count = self.histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            counts = [n + (value <= bound) for n, bound in zip(counts, buckets)]
+            self.histograms[key] = (counts, total + value, count + 1)
+        self.maybe_flush()
+
+    def set(self, name, labels, value):
+        self.check_fork()
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = (value, time.time())
+        self.maybe_flush()
+
+    def dump(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, *values] for (name, labels), values in self.histograms.items()],
+                'gauges': [[name, labels, *values] for (name, labels), values in self.gauges.items()],
+            }
+
+    def flush(self, directory=None):
+        directory = directory or settings.METRICS['DIRECTORY']
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.file_name)
+        temp_path = f'{path}.{get_ident()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.dump(), file)
+        os.replace(temp_path, path)
+        self.flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        if settings.METRICS['DIRECTORY'] and \
+                time.monotonic() - self.flushed_at >= settings.METRICS['FLUSH_INTERVAL']:
+            self.flush()
+
+
+registry = Registry()
+atexit.register(lambda: registry.flush())
+
+
+def collect():
+    """
+    Сумма метрик всех процессов: счётчики и гистограммы складываются,
+    у датчиков берётся последнее записанное значение
+    """
+    directory = settings.METRICS['DIRECTORY']
+    if directory:
+        registry.flush()
+        dumps = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as file:
+                    dumps.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+    else:
+        dumps = [registry.dump()]
+
+    counters, histograms, gauges = {}, {}, {}
+    for dump in dumps:
+        for name, labels, value in dump['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total, count in dump['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            old_counts, old_total, old_count = histograms.get(key, ([0] * len(counts), 0.0, 0))
+            histograms[key] = ([a + b for a, b in zip(old_counts, counts)], old_total + total, old_count + count)
+        for name, labels, value, timestamp in dump['gauges']:
+            key = (name, tuple(map(tuple, labels)))
+            if key not in gauges or gauges[key][1] < timestamp:
+                gauges[key] = (value, timestamp)
+    return counters, histograms, gauges
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render():
+    """
+    Метрики в текстовом формате Prometheus 0.0.4
+    """
+    counters, histograms, gauges = collect()
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, value in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {value}')
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        else:
+            values = counters if kind == 'counter' else {key: value for key, (value, _) in gauges.items()}
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def observe_request(view, method, status, seconds):
+    registry.observe('http_request_duration_seconds', {'view': view, 'method': method}, seconds)
+    registry.inc('http_responses_total', {'view': view, 'status': status})
+
+
+def observe_import(shop, seconds, stats):
+    """
+    Длительность и объём импорта прайс-листа магазина, stats - счётчики CatalogImporter
+    """
+    rows = sum(stats.get(kind, 0) for kind in ('inserted', 'updated', 'deleted', 'unchanged'))
+    registry.observe('price_import_duration_seconds', {}, seconds)
+    registry.set('price_import_last_duration_seconds', {'shop': shop}, seconds)
+    registry.set('price_import_rows_per_second', {'shop': shop}, round(rows / seconds, 1) if seconds else 0)
+    for kind in ('inserted', 'updated', 'deleted', 'unchanged'):
+        registry.inc('price_import_rows_total', {'shop': shop, 'result': kind}, stats.get(kind, 0))
@@ -0,0 +1,187 @@
+"""
+Замеры запросов: число и время SQL-запросов, время сериализации и общее
+время ответа. Результат отдаётся в заголовке Server-Timing и пишется в лог
+backend.requests одной JSON-строкой; медленные запросы логируются вместе
+с самыми долгими SQL-запросами. Задержки и коды ответов по адресам
+собираются в метрики Prometheus, см. backend/metrics.py.
+Сотрудники могут снять профиль отдельного запроса, см. ProfilerMiddleware
+"""
+import heapq
+import json
+import logging
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+from .authentication import get_token_user
+from .metrics import observe_request
+from .models import RequestProfile
+from .profiling import profile_call
+
+logger = logging.getLogger('backend.requests')
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, worst_queries):
+        self.worst_queries = worst_queries
+        self.queries = 0
+        self.sql_time = 0.0
+        self.worst = []
+        self.timings = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Обёртка connection.execute_wrapper
+        """
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            self.queries += 1
+            self.sql_time += duration
+            if len(self.worst) < self.worst_queries:
+                heapq.heappush(self.worst, (duration, self.queries, sql))
+            elif duration > self.worst[0][0]:
+                heapq.heapreplace(self.worst, (duration, self.queries, sql))
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+
+@contextmanager
+def timing(name):
+    """
+    Добавляет время блока к замерам текущего запроса, например timing('serialize').
+    SQL-запросы внутри блока учитываются только в db, их время вычитается.
+    Без RequestTimingMiddleware ничего не делает
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started, sql_time = perf_counter(), metrics.sql_time
+    try:
+        yield
+    finally:
+        metrics.add(name, perf_counter() - started - (metrics.sql_time - sql_time))
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestTimingMiddleware:
+    """
+    Настраивается в REQUEST_TIMING; при ENABLED = False исключается из цепочки
+    """
+    def __init__(self, get_response):
+        options = settings.REQUEST_TIMING
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request = options['SLOW_REQUEST']
+        self.worst_queries = options['WORST_QUERIES']
+
+    def __call__(self, request):
+        metrics = RequestMetrics(self.worst_queries)
+        token = current_metrics.set(metrics)
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        total = perf_counter() - started
+
+        response['Server-Timing'] = ', '.join(
+            [f'db;dur={milliseconds(metrics.sql_time)};desc="{metrics.queries} queries"'] +
+            [f'{name};dur={milliseconds(duration)}' for name, duration in metrics.timings.items()] +
+            [f'total;dur={milliseconds(total)}'])
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.url_name if match else None,
+            'status': response.status_code,
+            'total_ms': milliseconds(total),
+            'db_ms': milliseconds(metrics.sql_time),
+            'queries': metrics.queries,
+            **{f'{name}_ms': milliseconds(duration) for name, duration in metrics.timings.items()},
+        }
+        if total >= self.slow_request:
+            record['worst_queries'] = [{'ms': milliseconds(duration), 'sql': sql[:1000]}
+                                       for duration, _, sql in sorted(metrics.worst, reverse=True)]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Задержки и коды ответов по имени адреса для /metrics.
+    При METRICS['ENABLED'] = False исключается из цепочки
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        observe_request(match.url_name if match and match.url_name else 'unknown', request.method,
+                        response.status_code, perf_counter() - started)
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Профилирует запрос сотрудника, если передан заголовок X-Profile или
+    аргумент profile. Профиль сохраняется в RequestProfile, его id
+    возвращается в заголовке X-Profile-Id; со значением stats вместо
+    ответа возвращается сводка профиля.
+    Остальные запросы проходят без профилирования, проверяется только
+    наличие флага. При PROFILER['ENABLED'] = False исключается из цепочки
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILER['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.top = settings.PROFILER['TOP']
+
+    def __call__(self, request):
+        mode = request.headers.get('X-Profile') or request.GET.get('profile')
+        if not mode or mode == '0':
+            return self.get_response(request)
+
+        user = get_token_user(request.headers['token']) if request.headers.get('token') else None
+        if user is None or not (user.is_active and user.is_staff):
+            return self.get_response(request)
+
+        started = perf_counter()
+        response, profiler, stats, data = profile_call(lambda: self.get_response(request), self.top)
+        duration = perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        profile = RequestProfile.objects.create(
+            user=user, method=request.method, path=request.get_full_path()[:2000],
+            view=(match.url_name or '') if match else '', status=response.status_code, duration=duration,
+            profiler=profiler, stats=stats, data=data)
+
+        if mode == 'stats':
+            response = HttpResponse(stats, content_type='text/plain; charset=utf-8')
+        response['X-Profile-Id'] = profile.id
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_auto_20201119_1404'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='unique_product_info'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_productinfo_unique_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(verbose_name='Ссылка')),
+                ('replace', models.BooleanField(default=False, verbose_name='Заменить каталог')),
+                ('state', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка')], db_index=True, default='queued', max_length=10, verbose_name='Статус')),
+                ('inserted', models.PositiveIntegerField(default=0, verbose_name='Добавлено')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Обновлено')),
+                ('deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено')),
+                ('unchanged', models.PositiveIntegerField(default=0, verbose_name='Без изменений')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка прайс-листа',
+                'verbose_name_plural': 'Загрузки прайс-листов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
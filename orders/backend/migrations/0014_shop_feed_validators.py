@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Last-Modified прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_sha256',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256 прайс-листа'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='state',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('unchanged', 'Без изменений'), ('failed', 'Ошибка')], db_index=True, default='queued', max_length=10, verbose_name='Статус'),
+        ),
+    ]
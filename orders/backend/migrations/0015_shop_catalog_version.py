@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_shop_feed_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='catalog_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия каталога'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_shop_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='catalog_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Каталог изменен'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE backend_productinfo_fts "
+            "USING fts5(name, model, product, parameters, tokenize='unicode61')")
+        cursor.execute(
+            "INSERT INTO backend_productinfo_fts (rowid, name, model, product, parameters) "
+            "SELECT pi.id, pi.name, pi.model, p.name, "
+            "(SELECT group_concat(pp.value, ' ') FROM backend_productparameter pp WHERE pp.product_info_id = pi.id) "
+            "FROM backend_productinfo pi JOIN backend_product p ON p.id = pi.product_id")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS backend_productinfo_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_shop_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50, verbose_name='Слово')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='Вес')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='backend.productinfo', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Слово поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token', 'product_info'], name='search_token_idx'),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
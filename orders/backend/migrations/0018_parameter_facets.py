@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=50, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='backend.category', verbose_name='Категория')),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='backend.parameter', verbose_name='Параметр')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Значение фильтра',
+                'verbose_name_plural': 'Значения фильтров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='parameterfacet',
+            index=models.Index(fields=['category', 'shop'], name='facet_category_shop_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+def fill_parameters(apps, schema_editor):
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.order_by('id').values_list(
+            'product_info_id', 'parameter__name', 'value'):
+        parameters.setdefault(product_info_id, []).append([name, value])
+
+    product_infos = list(ProductInfo.objects.filter(id__in=parameters).only('id'))
+    for product_info in product_infos:
+        product_info.parameters = parameters[product_info.id]
+    ProductInfo.objects.bulk_update(product_infos, ['parameters'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_parameter_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='parameters',
+            field=models.JSONField(blank=True, default=list, verbose_name='Параметры'),
+        ),
+        migrations.RunPython(fill_parameters, migrations.RunPython.noop),
+    ]
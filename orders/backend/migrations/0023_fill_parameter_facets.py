@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def fill_facets(apps, schema_editor):
+    ParameterFacet = apps.get_model('backend', 'ParameterFacet')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+
+    # same aggregation as backend.facets.refresh_facets, for all shops at once
+    ParameterFacet.objects.all().delete()
+    counts = ProductParameter.objects.values(
+        'product_info__shop_id', 'product_info__product__category_id', 'parameter_id', 'value').annotate(
+        count=Count('id')).order_by()
+    ParameterFacet.objects.bulk_create([
+        ParameterFacet(shop_id=row['product_info__shop_id'], category_id=row['product_info__product__category_id'],
+                       parameter_id=row['parameter_id'], value=row['value'], count=row['count'])
+        for row in counts
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0022_request_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
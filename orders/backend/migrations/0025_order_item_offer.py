@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:17
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def pin_offers(apps, schema_editor):
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+
+    # the offer that offer_price() used to report for the item
+    current = ProductInfo.objects.filter(
+        product_id=OuterRef('product_id'), shop_id=OuterRef('shop_id')).order_by('-id').values('id')[:1]
+    OrderItem.objects.filter(product_info__isnull=True).update(product_info=Subquery(current))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0024_import_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_info',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='backend.productinfo', verbose_name='Предложение'),
+        ),
+        migrations.RunPython(pin_offers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0025_order_item_offer'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='importjob',
+            name='heartbeat_at',
+        ),
+    ]
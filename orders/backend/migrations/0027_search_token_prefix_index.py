@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:02
+
+from django.db import migrations
+
+
+def create_prefix_index(apps, schema_editor):
+    # LIKE 'x%' uses a btree index only in the C collation or with a pattern opclass
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS search_token_prefix_idx '
+            'ON backend_searchtoken (token varchar_pattern_ops)')
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS search_token_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0026_import_job_lease_in_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.utils import timezone
 from django.utils.translation import ugettext
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -15,6 +17,20 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+EMAIL_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Не отправлено'),
+)
+
+IMPORT_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('unchanged', 'Без изменений'),
+    ('failed', 'Ошибка'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -104,6 +120,11 @@ class Shop(models.Model):
     url = models.URLField(verbose_name='Ссылка', null=True, blank=True)
     filename = models.CharField(max_length=100)
     state = models.BooleanField(verbose_name='Принимает заказы?', default=True)
+    feed_etag = models.CharField(max_length=200, verbose_name='ETag прайс-листа', blank=True)
+    feed_last_modified = models.CharField(max_length=50, verbose_name='Last-Modified прайс-листа', blank=True)
+    feed_sha256 = models.CharField(max_length=64, verbose_name='SHA-256 прайс-листа', blank=True)
+    catalog_version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
+    catalog_updated_at = models.DateTimeField(verbose_name='Каталог изменен', blank=True, null=True)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -114,6 +135,94 @@ class Shop(models.Model):
         return self.name
 
 
+class ImportJob(models.Model):
+    """
+    Задание на загрузку прайс-листа, выполняется командой process_import_jobs.
+    Аренда и счётчики выполняющегося задания хранятся в кэше, см. backend/tasks.py
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_jobs', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка')
+    replace = models.BooleanField(verbose_name='Заменить каталог', default=False)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=10, default='queued',
+                             db_index=True)
+    inserted = models.PositiveIntegerField(verbose_name='Добавлено', default=0)
+    updated = models.PositiveIntegerField(verbose_name='Обновлено', default=0)
+    deleted = models.PositiveIntegerField(verbose_name='Удалено', default=0)
+    unchanged = models.PositiveIntegerField(verbose_name='Без изменений', default=0)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    attempts = models.PositiveIntegerField(verbose_name='Попыток', default=0)
+    created_at = models.DateTimeField(verbose_name='Создано', auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name='Начато', blank=True, null=True)
+    finished_at = models.DateTimeField(verbose_name='Завершено', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайс-листа'
+        verbose_name_plural = 'Загрузки прайс-листов'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.url} ({self.state})'
+
+
+class OutgoingEmail(models.Model):
+    """
+    Письмо в очереди на отправку, отправляется командой send_queued_emails
+    """
+    subject = models.CharField(verbose_name='Тема', max_length=255)
+    body = models.TextField(verbose_name='Текст', blank=True)
+    from_email = models.CharField(verbose_name='Отправитель', max_length=255, blank=True)
+    to = models.JSONField(verbose_name='Получатели', default=list)
+    state = models.CharField(verbose_name='Статус', choices=EMAIL_STATE_CHOICES, max_length=10, default='queued')
+    attempts = models.PositiveSmallIntegerField(verbose_name='Попыток', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка', default=timezone.now)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(verbose_name='Создано', auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='Отправлено', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_at'], name='email_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} ({self.state})'
+
+
+class RequestProfile(models.Model):
+    """
+    Профиль одного запроса, снятый по запросу сотрудника, см. ProfilerMiddleware
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='request_profiles', blank=True,
+                             null=True, on_delete=models.SET_NULL)
+    method = models.CharField(verbose_name='Метод', max_length=10)
+    path = models.CharField(verbose_name='Адрес', max_length=2000)
+    view = models.CharField(verbose_name='Имя адреса', max_length=100, blank=True)
+    status = models.PositiveSmallIntegerField(verbose_name='Код ответа')
+    duration = models.FloatField(verbose_name='Длительность, с')
+    profiler = models.CharField(verbose_name='Профилировщик', max_length=20)
+    stats = models.TextField(verbose_name='Статистика', blank=True)
+    data = models.BinaryField(verbose_name='Профиль')
+    created_at = models.DateTimeField(verbose_name='Создано', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.created_at})'
+
+    @property
+    def file_name(self):
+        return f'profile-{self.id}.{"html" if self.profiler == "pyinstrument" else "prof"}'
+
+
 class Category(models.Model):
     name = models.CharField(max_length=50, verbose_name='Название')
     shop = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories', blank=True)
@@ -140,6 +249,23 @@ class Product(models.Model):
     #     return self.name
 
 
+class ProductInfoQuerySet(models.QuerySet):
+    def offers(self):
+        """
+        Предложения в порядке выбора для пары (товар, магазин): если у товара
+        в магазине несколько позиций, берётся добавленная последней
+        """
+        return self.order_by('-id')
+
+    def for_catalog(self):
+        """
+        Всё, что нужно ProductInfoSerializer, загружается постоянным числом запросов
+        """
+        return self.select_related('shop', 'product__category').prefetch_related(
+            models.Prefetch('product_parameters',
+                            queryset=ProductParameter.objects.select_related('parameter').order_by('id')))
+
+
 class ProductInfo(models.Model):
     product = models.ForeignKey(Product, verbose_name='Продукт', related_name='product_infos', blank=True,
                                 on_delete=models.CASCADE)
@@ -152,10 +278,21 @@ class ProductInfo(models.Model):
 
     external_id = models.PositiveIntegerField(verbose_name='External id', default=None)
     model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    # [[parameter name, value], ...] in ProductParameter order, kept in sync by the import.
+    # ProductParameter stays the source of truth, see check_parameter_blobs
+    parameters = models.JSONField(verbose_name='Параметры', default=list, blank=True)
+
+    objects = ProductInfoQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = 'Информация о продуктах'
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_product_info'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'shop'], name='product_info_offer_idx'),
+        ]
         # ordering = ('-name',)
 
     def __str__(self):
@@ -190,15 +327,92 @@ class ProductParameter(models.Model):
     #     return self.name
 
 
+class ParameterFacet(models.Model):
+    """
+    Число предложений магазина в категории с данным значением параметра.
+    Пересчитывается импортом прайс-листа
+    """
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='facets', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='facets', on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facets', on_delete=models.CASCADE)
+    value = models.CharField(max_length=50, verbose_name='Значение')
+    count = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Значение фильтра'
+        verbose_name_plural = 'Значения фильтров'
+        indexes = [
+            models.Index(fields=['category', 'shop'], name='facet_category_shop_idx'),
+        ]
+
+
+class SearchToken(models.Model):
+    """
+    Инвертированный индекс для поиска товаров на СУБД без FTS5.
+    Индекс для поиска по префиксу на PostgreSQL создаётся миграцией 0027
+    """
+    token = models.CharField(max_length=50, verbose_name='Слово')
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Продукт', related_name='search_tokens',
+                                     on_delete=models.CASCADE)
+    weight = models.PositiveSmallIntegerField(verbose_name='Вес', default=1)
+
+    class Meta:
+        verbose_name = 'Слово поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+        indexes = [
+            models.Index(fields=['token', 'product_info'], name='search_token_idx'),
+        ]
+
+
+def offer_price():
+    """
+    Цена позиции заказа для подзапроса: цена выбранного предложения, а если
+    оно удалено - текущего предложения товара в магазине, как при оформлении
+    """
+    current = ProductInfo.objects.filter(
+        product_id=models.OuterRef('product'), shop_id=models.OuterRef('shop')).offers().values('price')[:1]
+    return Coalesce(models.F('product_info__price'), models.Subquery(current))
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Число позиций (item_count) и сумма заказа (total_sum) считаются в том же запросе
+        """
+        items = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        count = items.annotate(count=models.Count('id')).values('count')
+        total = items.annotate(total=models.Sum(models.F('quantity') * offer_price(),
+                                                output_field=models.IntegerField())).values('total')
+        return self.annotate(
+            item_count=Coalesce(models.Subquery(count, output_field=models.IntegerField()), 0),
+            total_sum=Coalesce(models.Subquery(total, output_field=models.IntegerField()), 0))
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_prices(self):
+        """
+        Текущая цена (price) и сумма позиции (total)
+        """
+        return self.annotate(price=offer_price()).annotate(
+            total=models.ExpressionWrapper(models.F('quantity') * models.F('price'),
+                                           output_field=models.IntegerField()))
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, verbose_name='Пользователь', related_name='orders', blank=True, null=True,
                                 on_delete=models.CASCADE)
     datetime = models.DateTimeField(auto_now_add=True)
     status = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
-    
+
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['user', 'status', 'datetime'], name='order_user_status_idx'),
+            models.Index(fields=['status', 'datetime'], name='order_status_idx'),
+        ]
         # ordering = ('-name',)
 
     # def __str__(self):
@@ -212,8 +426,12 @@ class OrderItem(models.Model):
                                 on_delete=models.CASCADE)
     shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='ordered_items', blank=True,
                                 on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Предложение', related_name='ordered_items',
+                                     blank=True, null=True, on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(verbose_name='Количество') 
 
+    objects = OrderItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Продукт в заказе'
         verbose_name_plural = 'Список продуктов заказа'
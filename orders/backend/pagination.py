@@ -0,0 +1,60 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductInfoCursorPagination(CursorPagination):
+    """
+    Постраничный вывод товаров по курсору.
+    Следующая страница выбирается условием по ключу сортировки, а не OFFSET,
+    поэтому любая страница стоит столько же, сколько первая
+    """
+    ordering = 'id'
+    ordering_fields = ('id', 'price', 'price_rrc', 'quantity')
+    ordering_param = 'ordering'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param, self.ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            ordering = self.ordering
+        if ordering.lstrip('-') == 'id':
+            return (ordering, )
+        # the cursor keeps a position and an offset among equal values,
+        # so the order within them must not change between requests
+        return (ordering, '-id' if ordering.startswith('-') else 'id')
+
+
+class LookaheadPagination:
+    """
+    Постраничный вывод по номеру страницы без COUNT: выбирается на строку больше
+    размера страницы, лишняя строка говорит, есть ли следующая.
+    Неверные page и page_size - ValueError
+    """
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, request, max_page_size=100):
+        self.request = request
+        self.page = max(int(request.query_params.get(self.page_query_param, 1)), 1)
+        self.page_size = min(max(int(request.query_params.get(self.page_size_query_param,
+                                                              settings.REST_FRAMEWORK['PAGE_SIZE'])), 1),
+                             max_page_size)
+        self.offset = (self.page - 1) * self.page_size
+        self.limit = self.page_size + 1
+        self.has_next = False
+
+    def paginate(self, rows):
+        """
+        Строки страницы из выбранных offset, limit
+        """
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_links(self):
+        url = self.request.build_absolute_uri()
+        return {
+            'Next': replace_query_param(url, self.page_query_param, self.page + 1) if self.has_next else None,
+            'Previous': replace_query_param(url, self.page_query_param, self.page - 1) if self.page > 1 else None
+        }
@@ -0,0 +1,226 @@
+"""
+Потоковое чтение прайс-листов поставщиков
+"""
+import asyncio
+import os
+import pickle
+import time
+from collections import namedtuple
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from requests import Session
+from requests.exceptions import ConnectionError as RequestsConnectionError, TooManyRedirects
+from urllib3.exceptions import HTTPError
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.events import MappingEndEvent, MappingStartEvent, SequenceEndEvent, SequenceStartEvent
+from yaml.resolver import Resolver
+
+try:
+    from yaml.cyaml import CParser
+except ImportError:
+    CParser = None
+
+
+if CParser is not None:
+    class PriceListLoader(CParser, Composer, SafeConstructor, Resolver):
+        """
+        Безопасный загрузчик на базе libyaml, собирающий документ по частям
+        """
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+else:
+    from yaml.parser import Parser
+    from yaml.reader import Reader
+    from yaml.scanner import Scanner
+
+    class PriceListLoader(Reader, Scanner, Parser, Composer, SafeConstructor, Resolver):
+        """
+        Безопасный загрузчик на чистом Python, собирающий документ по частям
+        """
+        def __init__(self, stream):
+            Reader.__init__(self, stream)
+            Scanner.__init__(self)
+            Parser.__init__(self)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+
+def iter_price_list(stream):
+    """
+    Читает прайс-лист и по одной отдаёт пары (раздел, значение):
+    ('shop', 'Связной'), ('categories', {...}), ('goods', {...}).
+    Элементы списков отдаются по отдельности, поэтому в памяти
+    одновременно находится только одна позиция
+    """
+    loader = PriceListLoader(stream)
+
+    def construct():
+        return loader.construct_document(loader.compose_node(None, None))
+
+    try:
+        # StreamStart, DocumentStart
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise ValueError('Price list must be a mapping')
+        loader.get_event()
+
+        while not loader.check_event(MappingEndEvent):
+            section = construct()
+            if loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield section, construct()
+                loader.get_event()
+            else:
+                yield section, construct()
+    finally:
+        loader.dispose()
+
+
+PriceListDownload = namedtuple('PriceListDownload', 'path not_modified etag last_modified sha256')
+
+
+class PriceListFetchError(Exception):
+    """
+    Прайс-лист не скачан из-за ограничений: размер, время, редиректы, схема ссылки
+    """
+
+
+def download_price_list(url, timeout=None, etag='', last_modified='', chunk_size=64 * 1024,
+                        max_size=None, max_time=None, max_redirects=None):
+    """
+    Скачивает прайс-лист во временный файл, считая SHA-256 тела.
+    Запрос условный, если переданы ETag или Last-Modified прошлой загрузки;
+    при ответе 304 файл не создаётся.
+
+    timeout - таймауты соединения и чтения, max_size - предел размера тела в байтах,
+    max_time - предел времени всей загрузки в секундах, max_redirects - предел числа
+    редиректов. По умолчанию берутся из настроек PRICE_LIST_*
+
+    Таймаут чтения ограничивает только паузу между порциями данных, поэтому тело
+    читается через read1 (urllib3 2), который возвращает то, что пришло за одно
+    чтение из сокета, и время проверяется после каждого чтения. Таймаут чтения
+    не больше max_time, так что загрузка превышает max_time не больше чем на него
+    """
+    max_size = max_size or settings.PRICE_LIST_MAX_SIZE
+    max_time = max_time or settings.PRICE_LIST_MAX_TIME
+    if urlsplit(url).scheme not in ('http', 'https'):
+        raise PriceListFetchError(f'Unsupported url scheme: {url}')
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    timeout = timeout or settings.PRICE_LIST_TIMEOUT
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    read_timeout = min(read_timeout or max_time, max_time)
+
+    deadline = time.monotonic() + max_time
+    with Session() as session:
+        session.max_redirects = settings.PRICE_LIST_MAX_REDIRECTS if max_redirects is None else max_redirects
+        try:
+            response = session.get(url, stream=True, headers=headers,
+                                   timeout=(connect_timeout, read_timeout))
+        except TooManyRedirects:
+            raise PriceListFetchError(f'More than {session.max_redirects} redirects')
+
+        with response:
+            if response.status_code == 304:
+                return PriceListDownload(None, True, etag, last_modified, '')
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > max_size:
+                raise PriceListFetchError(f'Price list is larger than {max_size} bytes')
+
+            digest, size = sha256(), 0
+            with NamedTemporaryFile(prefix='price-list-', suffix='.yaml', delete=False) as file:
+                try:
+                    while True:
+                        try:
+                            chunk = response.raw.read1(chunk_size, decode_content=True)
+                        except HTTPError as e:
+                            if time.monotonic() <= deadline:
+                                raise RequestsConnectionError(e)
+                            chunk = None
+                        if time.monotonic() > deadline:
+                            raise PriceListFetchError(f'Price list download took longer than {max_time}s')
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > max_size:
+                            raise PriceListFetchError(f'Price list is larger than {max_size} bytes')
+                        digest.update(chunk)
+                        file.write(chunk)
+                except BaseException:
+                    file.close()
+                    os.remove(file.name)
+                    raise
+
+    return PriceListDownload(file.name, False, response.headers.get('ETag', ''),
+                             response.headers.get('Last-Modified', ''), digest.hexdigest())
+
+
+async def download_price_lists_async(feeds, concurrency=8, **kwargs):
+    """
+    Скачивает несколько прайс-листов одновременно.
+    feeds - {ключ: {'url': ..., 'etag': ..., 'last_modified': ...}}, возвращает
+    {ключ: PriceListDownload или исключение}. Одновременно выполняется не больше
+    concurrency загрузок; каждая идёт в своём потоке, так как requests блокирующий
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(feed):
+        async with semaphore:
+            return await asyncio.to_thread(download_price_list, **feed, **kwargs)
+
+    keys = list(feeds)
+    results = await asyncio.gather(*(fetch(feeds[key]) for key in keys), return_exceptions=True)
+    return dict(zip(keys, results))
+
+
+def download_price_lists(feeds, concurrency=8, **kwargs):
+    """
+    Синхронная обёртка над download_price_lists_async
+    """
+    return asyncio.run(download_price_lists_async(feeds, concurrency, **kwargs))
+
+
+def parse_price_list(path):
+    """
+    Разбирает скачанный прайс-лист и по одной записывает пары (раздел, значение)
+    в pickle-файл рядом с ним, возвращает путь к файлу. Выполняется в процессе
+    разбора: результат не передаётся целиком между процессами и не держится
+    в памяти, а читается потоком через iter_parsed_price_list
+    """
+    with open(path, 'rb') as source, \
+            NamedTemporaryFile(prefix='price-list-', suffix='.pickle', delete=False) as target:
+        try:
+            for entry in iter_price_list(source):
+                pickle.dump(entry, target, pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            target.close()
+            os.remove(target.name)
+            raise
+    return target.name
+
+
+def iter_parsed_price_list(path):
+    """
+    Читает по одной пары, записанные parse_price_list
+    """
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
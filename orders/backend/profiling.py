@@ -0,0 +1,42 @@
+"""
+Профилирование отдельного вызова: pyinstrument, если установлен,
+иначе cProfile
+"""
+import cProfile
+import marshal
+import pstats
+from io import StringIO
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+
+def profile_call(func, top=30):
+    """
+    Выполняет func под профилировщиком.
+    Возвращает (результат, имя профилировщика, текстовая сводка, данные профиля).
+    Для cProfile сводка - top функций по cumulative, данные - файл .prof для pstats
+    и snakeviz; для pyinstrument - дерево вызовов и HTML-отчёт
+    """
+    if SamplingProfiler is not None:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            result = func()
+        finally:
+            profiler.stop()
+        return result, 'pyinstrument', profiler.output_text(), profiler.output_html().encode()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = func()
+    finally:
+        profiler.disable()
+
+    stream = StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+    profiler.create_stats()
+    return result, 'cprofile', stream.getvalue(), marshal.dumps(profiler.stats)
@@ -0,0 +1,124 @@
+"""
+Полнотекстовый поиск товаров.
+
+На SQLite с FTS5 используется виртуальная таблица FTS_TABLE, на остальных
+СУБД - инвертированный индекс SearchToken. Индекс обновляется импортом
+прайс-листов по мере изменения позиций.
+
+Слова запроса ищутся в SearchToken как префиксы (LIKE 'x%'). На PostgreSQL
+для этого есть индекс search_token_prefix_idx с varchar_pattern_ops
+(миграция 0027), на других СУБД без FTS5 префиксный поиск может читать
+весь индекс
+"""
+import re
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Max, Q, Sum, When
+
+from .models import ProductInfo, ProductParameter, SearchToken
+
+FTS_TABLE = 'backend_productinfo_fts'
+
+# field weights for the SearchToken index
+WEIGHTS = {'name': 3, 'model': 2, 'product': 2, 'parameters': 1}
+
+MAX_TERMS = 8
+
+_use_fts = None
+
+
+def use_fts():
+    global _use_fts
+    if _use_fts is None:
+        _use_fts = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _use_fts
+
+
+def tokenize(text):
+    return re.findall(r'\w+', str(text).lower())
+
+
+def _documents(ids):
+    documents = {
+        product_info_id: {'name': name, 'model': model, 'product': product, 'parameters': []}
+        for product_info_id, name, model, product in ProductInfo.objects.filter(id__in=ids).values_list(
+            'id', 'name', 'model', 'product__name')
+    }
+    for product_info_id, value in ProductParameter.objects.filter(product_info_id__in=ids).values_list(
+            'product_info_id', 'value'):
+        documents[product_info_id]['parameters'].append(value)
+    return documents
+
+
+def remove_product_infos(ids):
+    """
+    Удаляет позиции из индекса. Строки SearchToken удаляются каскадно вместе с ProductInfo
+    """
+    if ids and use_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', list(ids))
+
+
+def index_product_infos(ids):
+    """
+    Переиндексирует позиции после добавления или изменения
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    documents = _documents(ids)
+
+    if use_fts():
+        remove_product_infos(ids)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, model, product, parameters) VALUES (%s, %s, %s, %s, %s)',
+                [(product_info_id, doc['name'], doc['model'], doc['product'], ' '.join(doc['parameters']))
+                 for product_info_id, doc in documents.items()])
+        return
+
+    SearchToken.objects.filter(product_info_id__in=ids).delete()
+    tokens = []
+    for product_info_id, doc in documents.items():
+        weights = Counter()
+        for field, weight in WEIGHTS.items():
+            values = doc[field] if field == 'parameters' else [doc[field]]
+            for value in values:
+                for token in tokenize(value):
+                    weights[token[:50]] += weight
+        tokens.extend(SearchToken(token=token, product_info_id=product_info_id, weight=weight)
+                      for token, weight in weights.items())
+    SearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+def search(query, limit, offset=0):
+    """
+    Id позиций магазинов, принимающих заказы, в порядке релевантности.
+    Каждое слово запроса ищется как префикс, все слова обязательны
+    """
+    terms = tokenize(query)[:MAX_TERMS]
+    if not terms:
+        return []
+
+    if use_fts():
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT f.rowid FROM {FTS_TABLE} f '
+                f'JOIN backend_productinfo p ON p.id = f.rowid '
+                f'JOIN backend_shop s ON s.id = p.shop_id '
+                f'WHERE {FTS_TABLE} MATCH %s AND s.state '
+                f'ORDER BY bm25({FTS_TABLE}, 3.0, 2.0, 2.0, 1.0), f.rowid LIMIT %s OFFSET %s',
+                [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    hits = {
+        f'term_{i}': Max(Case(When(token__startswith=term, then=1), default=0, output_field=IntegerField()))
+        for i, term in enumerate(terms)
+    }
+    matches = SearchToken.objects.filter(
+        Q(*[Q(token__startswith=term) for term in terms], _connector=Q.OR), product_info__shop__state=True)
+    ranked = matches.values('product_info_id').annotate(score=Sum('weight'), **hits).filter(
+        **{name: 1 for name in hits}).order_by('-score', 'product_info_id')
+    return [row['product_info_id'] for row in ranked[offset:offset + limit]]
@@ -1,5 +1,6 @@
+from django.db import models
 from rest_framework import serializers
-from .models import User, Contact, Shop, Product, ProductParameter, ProductInfo
+from .models import User, Contact, Shop, Product, ProductParameter, ProductInfo, ImportJob, Order, OrderItem
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -52,3 +53,116 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         model = ProductInfo
         fields = ('id', 'model', 'product', 'quantity', 'price', 'price_rrc', 'product_parameters', 'shop',)
         read_only_fields = ('id', )
+
+
+class ProductInfoReadSerializer:
+    """
+    Быстрый вариант ProductInfoSerializer(many=True) только для чтения.
+    Данные собираются из values() без ModelSerializer, параметры берутся
+    из ProductInfo.parameters без обращения к ProductParameter.
+    Результат совпадает с ProductInfoSerializer байт в байт.
+
+    Принимает QuerySet, строки project() - например, уже загруженную страницу
+    пагинатора, которая выводится без повторного запроса, - объекты ProductInfo
+    или их id; в последних двух случаях строки читаются одним запросом
+    """
+    fields = ('id', 'model', 'product__name', 'product__category__name', 'quantity', 'price', 'price_rrc',
+              'shop_id', 'parameters')
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    @classmethod
+    def project(cls, queryset):
+        """
+        Только поля, нужные для вывода
+        """
+        return queryset.values(*cls.fields)
+
+    def get_rows(self):
+        if isinstance(self.instances, models.QuerySet):
+            return list(self.project(self.instances))
+        items = list(self.instances)
+        if all(isinstance(item, dict) for item in items):
+            return items
+        ids = [item if isinstance(item, int) else item.id for item in items]
+        rows = {row['id']: row for row in self.project(ProductInfo.objects.filter(id__in=ids))}
+        return [rows[product_info_id] for product_info_id in ids if product_info_id in rows]
+
+    @property
+    def data(self):
+        return [{
+            'id': row['id'],
+            'model': row['model'],
+            'product': {'name': row['product__name'], 'category': row['product__category__name']},
+            'quantity': row['quantity'],
+            'price': row['price'],
+            'price_rrc': row['price_rrc'],
+            'product_parameters': [{'parameter': parameter, 'value': value} for parameter, value in row['parameters']],
+            'shop': row['shop_id'],
+        } for row in self.get_rows()]
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'product', 'shop', 'product_info', 'quantity', )
+        read_only_fields = ('id', )
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    ordered_items = OrderItemSerializer(read_only=True, many=True)
+
+    class Meta:
+        model = Order
+        fields = ('id', 'status', 'datetime', 'ordered_items', )
+        read_only_fields = ('id', )
+
+
+class OrderLineSerializer(OrderItemSerializer):
+    """
+    Позиция заказа из OrderItem.objects.with_prices()
+    """
+    price = serializers.IntegerField(read_only=True)
+    total = serializers.IntegerField(read_only=True)
+
+    class Meta(OrderItemSerializer.Meta):
+        fields = OrderItemSerializer.Meta.fields + ('price', 'total', )
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Заказ из Order.objects.with_totals()
+    """
+    item_count = serializers.IntegerField(read_only=True)
+    total_sum = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ('id', 'status', 'datetime', 'item_count', 'total_sum', )
+        read_only_fields = fields
+
+
+class OrderDetailSerializer(OrderSummarySerializer):
+    ordered_items = OrderLineSerializer(read_only=True, many=True)
+
+    class Meta(OrderSummarySerializer.Meta):
+        fields = OrderSummarySerializer.Meta.fields + ('ordered_items', )
+        read_only_fields = fields
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    duration = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'replace', 'state', 'shop', 'inserted', 'updated', 'deleted', 'unchanged', 'error',
+                  'created_at', 'started_at', 'finished_at', 'duration', )
+        read_only_fields = fields
+
+    def get_duration(self, obj):
+        if obj.started_at and obj.finished_at:
+            return (obj.finished_at - obj.started_at).total_seconds()
+        return None
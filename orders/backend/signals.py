@@ -1,8 +1,10 @@
-from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import Signal, receiver
-from django.core.mail import EmailMultiAlternatives
 from django_rest_passwordreset.signals import reset_password_token_created
+from rest_framework.authtoken.models import Token
 
+from .authentication import invalidate_token, invalidate_user_tokens
+from .mail import queue_email
 from .models import ConfirmEmailToken, User
 
 new_user_registered = Signal(
@@ -21,17 +23,14 @@ def new_user_registered_signal(user_id, **kwargs):
     """
     token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user_id)
 
-    msg = EmailMultiAlternatives(
+    queue_email(
         # title:
         f"Password reset token fo {token.user.email}",
         # message:
         token.key,
-        # from:
-        settings.EMAIL_HOST_USER,
         # to:
         [token.user.email]
     )
-    msg.send()
 
 
 @receiver(reset_password_token_created)
@@ -41,17 +40,14 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
     When a token is created, an e-mail needs to be sent to the user
     """
 
-    msg = EmailMultiAlternatives(
+    queue_email(
         # title:
         f"Password reset token for {reset_password_token.user}",
         # message:
         reset_password_token.key,
-        # from:
-        settings.EMAIL_HOST_USER,
         # to:
         [reset_password_token.user.email]
     )
-    msg.send()
 
 
 @receiver(new_order)
@@ -61,14 +57,28 @@ def new_order_signal(user_id, **kwargs):
     """
     user = User.objects.get(id=user_id)
 
-    msg = EmailMultiAlternatives(
+    queue_email(
         # title:
         f"Updating order status",
         # message:
         "Order formed",
-        # from:
-        settings.EMAIL_HOST_USER,
         # to:
         [user.email]
     )
-    msg.send()
\ No newline at end of file
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted_signal(instance, **kwargs):
+    """
+    Drop deleted token from the authentication cache
+    """
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved_signal(instance, created, **kwargs):
+    """
+    Drop cached user of all tokens when the user changes or gets deactivated
+    """
+    if not created:
+        invalidate_user_tokens(instance.id)
@@ -0,0 +1,211 @@
+"""
+Фоновые задания на загрузку прайс-листов
+"""
+import logging
+import os
+import time
+from threading import Event, Thread
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from .importer import import_entries
+from .metrics import observe_import, registry
+from .models import ImportJob, Shop
+from .pricelist import download_price_list, iter_price_list
+
+logger = logging.getLogger(__name__)
+
+JOB_COUNTERS = ('inserted', 'updated', 'deleted', 'unchanged')
+
+# a lease outlives its job only if the worker died
+LEASE_TIMEOUT = 24 * 60 * 60
+
+
+def job_cache():
+    return caches[settings.IMPORT_JOBS['CACHE']]
+
+
+def lease_key(job_id, attempt):
+    return f'import-job:{job_id}:{attempt}'
+
+
+def renew_lease(job_id, attempt, stats=None):
+    """
+    Продлевает аренду задания и запоминает его счётчики. Аренда и счётчики
+    хранятся в кэше IMPORT_JOBS['CACHE'], а не в БД: импорт идёт одной
+    транзакцией, и на SQLite запись в БД ждала бы её завершения
+    """
+    stats = stats or {}
+    job_cache().set(lease_key(job_id, attempt), {
+        'renewed_at': time.time(),
+        'stats': {counter: stats.get(counter, 0) for counter in JOB_COUNTERS},
+    }, LEASE_TIMEOUT)
+
+
+def get_job_progress(job):
+    """
+    Счётчики выполняющегося задания на момент последнего отклика обработчика
+    """
+    if job.state != 'running':
+        return None
+    lease = job_cache().get(lease_key(job.id, job.attempts))
+    return lease['stats'] if lease else {counter: 0 for counter in JOB_COUNTERS}
+
+
+def requeue_stale_jobs():
+    """
+    Возвращает в очередь задания, обработчик которых не продлевал аренду
+    дольше LEASE секунд. Задание, исчерпавшее MAX_ATTEMPTS попыток, получает
+    статус failed
+    """
+    options = settings.IMPORT_JOBS
+    running = list(ImportJob.objects.filter(state='running').values_list('id', 'attempts', 'started_at'))
+    if not running:
+        return 0
+    leases = job_cache().get_many([lease_key(job_id, attempt) for job_id, attempt, _ in running])
+
+    requeued, now = 0, time.time()
+    for job_id, attempt, started_at in running:
+        lease = leases.get(lease_key(job_id, attempt))
+        renewed_at = lease['renewed_at'] if lease else started_at.timestamp() if started_at else 0
+        if now - renewed_at <= options['LEASE']:
+            continue
+        stale = ImportJob.objects.filter(id=job_id, state='running', attempts=attempt)
+        if attempt >= options['MAX_ATTEMPTS']:
+            stale.update(state='failed', error='Worker stopped responding', finished_at=timezone.now())
+        else:
+            requeued += stale.update(state='queued')
+    return requeued
+
+
+def claim_next_job():
+    """
+    Атомарно переводит самое старое задание из очереди в работу
+    """
+    requeue_stale_jobs()
+    queued = ImportJob.objects.filter(state='queued').order_by('created_at', 'id').values_list('id', flat=True)
+    for job_id in queued[:10]:
+        if ImportJob.objects.filter(id=job_id, state='queued').update(
+                state='running', started_at=timezone.now(), attempts=F('attempts') + 1):
+            job = ImportJob.objects.get(id=job_id)
+            renew_lease(job.id, job.attempts)
+            return job
+    return None
+
+
+class Heartbeat(Thread):
+    """
+    Пока задание выполняется, раз в HEARTBEAT секунд продлевает его аренду
+    и сохраняет текущие счётчики
+    """
+    def __init__(self, job):
+        super().__init__(name=f'import-job-{job.id}', daemon=True)
+        self.job_id = job.id
+        self.attempt = job.attempts
+        self.stats = {}
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(settings.IMPORT_JOBS['HEARTBEAT']):
+            self.beat()
+
+    def beat(self):
+        try:
+            renew_lease(self.job_id, self.attempt, self.stats)
+        except Exception:
+            logger.warning('Import job %s: heartbeat failed', self.job_id, exc_info=True)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def get_feed_shop(url):
+    """
+    Магазин, прайс-лист которого ранее загружался по этой ссылке
+    """
+    return Shop.objects.filter(url=url).first()
+
+
+def download_feed(url, shop=None, timeout=None):
+    """
+    Скачивает прайс-лист условным запросом по данным прошлой загрузки магазина
+    """
+    if shop is None:
+        return download_price_list(url, timeout=timeout)
+    return download_price_list(url, timeout=timeout, etag=shop.feed_etag, last_modified=shop.feed_last_modified)
+
+
+def is_feed_unchanged(download, shop=None):
+    return download.not_modified or (shop is not None and download.sha256 == shop.feed_sha256)
+
+
+def import_feed(url, entries, download, replace=False, progress=None):
+    """
+    Загружает разобранный прайс-лист и запоминает ETag, Last-Modified
+    и хэш тела у магазина для следующих условных запросов
+    """
+    shops = []
+
+    def on_progress(importer):
+        shops.append(importer.shop)
+        if progress is not None:
+            progress(importer)
+
+    started = time.monotonic()
+    stats = import_entries(entries, replace=replace, progress=on_progress)
+    observe_import(shops[-1].name, time.monotonic() - started, stats)
+    Shop.objects.filter(id=shops[-1].id).update(url=url, feed_etag=download.etag,
+                                                feed_last_modified=download.last_modified,
+                                                feed_sha256=download.sha256)
+    return stats
+
+
+def run_import_job(job):
+    """
+    Загружает прайс-лист задания и сохраняет результат.
+    Если прайс-лист не изменился с прошлой загрузки, импорт пропускается.
+    Результат не сохраняется, если задание тем временем вернули в очередь
+    """
+    heartbeat = Heartbeat(job)
+
+    def progress(importer):
+        job.shop = importer.shop
+        heartbeat.stats = dict(importer.stats)
+
+    heartbeat.start()
+    shop = None if job.replace else get_feed_shop(job.url)
+    download = None
+    try:
+        download = download_feed(job.url, shop)
+        if is_feed_unchanged(download, shop):
+            job.shop = shop
+            job.state = 'unchanged'
+        else:
+            with open(download.path, 'rb') as file:
+                stats = import_feed(job.url, iter_price_list(file), download, replace=job.replace,
+                                    progress=progress)
+            job.state = 'done'
+            for counter in JOB_COUNTERS:
+                setattr(job, counter, stats[counter])
+    except Exception as e:
+        logger.exception('Import job %s failed', job.id)
+        job.state = 'failed'
+        job.error = str(e)
+    finally:
+        if download is not None and download.path:
+            os.remove(download.path)
+
+    heartbeat.stop()
+    job.finished_at = timezone.now()
+    finished = ImportJob.objects.filter(id=job.id, state='running', attempts=job.attempts).update(
+        shop=job.shop, state=job.state, error=job.error, finished_at=job.finished_at,
+        **{counter: getattr(job, counter) for counter in JOB_COUNTERS})
+    if not finished:
+        logger.warning('Import job %s was requeued while running, result is dropped', job.id)
+    job_cache().delete(lease_key(job.id, job.attempts))
+    registry.inc('price_import_jobs_total', {'state': job.state})
+    return job
@@ -1,3 +1,1150 @@
-from django.test import TestCase
+import json
+import os
+import time
+from functools import partial
+from io import BytesIO, StringIO
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from smtplib import SMTPException
+from tempfile import TemporaryDirectory
+from threading import Barrier, Event, Thread
+from unittest import mock
 
-# Create your tests here.
+import yaml
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import JsonResponse, QueryDict
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from requests.exceptions import HTTPError, RequestException
+from rest_framework.authtoken.models import Token
+
+from .authentication import get_token_user, local_cache
+from .benchmark import make_price_list, write_price_lists
+from .importer import import_entries, import_price_list, iter_entries
+from .mail import send_queued_emails
+from .metrics import Registry, registry
+from .pagination import ProductInfoCursorPagination
+from .middleware import RequestMetrics, current_metrics, timing
+from .pricelist import PriceListDownload, PriceListFetchError, download_price_list, download_price_lists, \
+    iter_parsed_price_list, iter_price_list, parse_price_list
+from . import search, tasks
+from .facets import filter_by_parameters, get_facets, parse_parameter_filters, refresh_facets
+from .models import User, Shop, Category, ProductInfo, ProductParameter, ParameterFacet, Order, OrderItem, OutgoingEmail, RequestProfile, \
+    ImportJob
+from .serializers import ProductInfoSerializer, ProductInfoReadSerializer
+from .tasks import Heartbeat, claim_next_job, import_feed, run_import_job
+
+
+def clear_caches():
+    """
+    Очищает кэши Django и локальный кэш токенов: LocMem-кэши переживают тесты
+    """
+    for cache in caches.all():
+        cache.clear()
+    local_cache.clear()
+
+
+def create_user_token(email='buyer@example.com', **extra):
+    """
+    Пользователь с паролем 'password' и его токен, username - часть адреса до @
+    """
+    user = User.objects.create_user(email, 'password', username=email.split('@')[0], **extra)
+    return user, Token.objects.create(user=user)
+
+
+class BuyerMixin:
+    """
+    Покупатель self.user с токеном self.token, кэши очищаются перед каждым тестом
+    """
+    def setUp(self):
+        super().setUp()
+        clear_caches()
+        self.user, self.token = create_user_token()
+
+
+class ProductsListQueriesTest(BuyerMixin, TestCase):
+    def count_queries(self, size):
+        import_price_list(make_price_list(size))
+        url = reverse('products-list')
+        # warm up the token cache
+        self.client.get(url, HTTP_TOKEN=self.token.key)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page_size': size}, HTTP_TOKEN=self.token.key)
+        self.assertEqual(len(response.json()['Data']), size)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.assertEqual(self.count_queries(3), self.count_queries(30))
+
+    def test_page_is_read_once(self):
+        # above the old 500-row chunks of ProductInfoReadSerializer
+        self.assertEqual(self.count_queries(1000), 1)
+
+
+class ProductInfoPaginationTest(BuyerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import_price_list(make_price_list(23))
+        # runs of equal values longer than a page
+        for n, product_info_id in enumerate(ProductInfo.objects.order_by('id').values_list('id', flat=True)):
+            ProductInfo.objects.filter(id=product_info_id).update(price=100 * (n % 3), price_rrc=n // 7, quantity=n % 2)
+
+    def walk(self, ordering):
+        rows, url, params = [], reverse('products-list'), {'ordering': ordering, 'page_size': 4}
+        while url:
+            response = self.client.get(url, params, HTTP_TOKEN=self.token.key).json()
+            rows += response['Data']
+            url, params = response['Next'], {}
+        return rows
+
+    def test_every_ordering_visits_each_row_once(self):
+        ids = sorted(ProductInfo.objects.values_list('id', flat=True))
+        for field in ProductInfoCursorPagination.ordering_fields:
+            for ordering in (field, f'-{field}'):
+                with self.subTest(ordering=ordering):
+                    rows = self.walk(ordering)
+                    self.assertEqual(sorted(row['id'] for row in rows), ids)
+                    # equal values go by id
+                    expected = sorted(rows, key=lambda row: (row[field], row['id']), reverse=ordering.startswith('-'))
+                    self.assertEqual([row['id'] for row in rows], [row['id'] for row in expected])
+
+
+class ImporterTest(TestCase):
+    def setUp(self):
+        self.data = make_price_list(20, parameters=2)
+        self.stats = import_price_list(self.data)
+        self.shop = Shop.objects.get()
+
+    def get_catalog(self):
+        return {
+            product_info.external_id: (product_info.id, product_info.price, dict(
+                product_info.product_parameters.values_list('parameter__name', 'value')))
+            for product_info in ProductInfo.objects.filter(shop=self.shop)
+        }
+
+    def test_insert(self):
+        self.assertEqual(self.stats, {'categories': 10, 'inserted': 20, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        self.assertEqual(self.shop.categories.count(), 10)
+        catalog = self.get_catalog()
+        self.assertEqual(sorted(catalog), list(range(1, 21)))
+        self.assertEqual(catalog[1][1:], (self.data['goods'][0]['price'], self.data['goods'][0]['parameters']))
+
+    def test_delta(self):
+        before = self.get_catalog()
+        goods = self.data['goods']
+        goods[0]['price'] += 1
+        goods[1]['parameters']['Параметр 1'] = 'Другое значение'
+        del goods[2]
+        goods.append(dict(goods[-1], id=21, name='Товар 21'))
+
+        stats = import_price_list(self.data)
+        self.assertEqual(stats, {'categories': 10, 'inserted': 1, 'updated': 2, 'deleted': 1, 'unchanged': 17})
+        after = self.get_catalog()
+        self.assertNotIn(3, after)
+        self.assertEqual(after[1], (before[1][0], before[1][1] + 1, before[1][2]))
+        self.assertEqual(after[2][2]['Параметр 1'], 'Другое значение')
+        # unchanged rows keep their ids
+        self.assertEqual(after[4], before[4])
+
+        self.assertEqual(import_price_list(self.data)['unchanged'], 20)
+
+    def test_replace(self):
+        before = self.get_catalog()
+        stats = import_price_list(self.data, replace=True)
+        self.assertEqual((stats['deleted'], stats['inserted']), (20, 20))
+        after = self.get_catalog()
+        self.assertEqual({key: value[1:] for key, value in after.items()},
+                         {key: value[1:] for key, value in before.items()})
+        self.assertFalse({value[0] for value in after.values()} & {value[0] for value in before.values()})
+
+    def count_queries(self, size):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                import_price_list(make_price_list(size, shop='Другой магазин'))
+            transaction.set_rollback(True)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # small enough for SQLite to insert each table in one statement
+        self.assertEqual(self.count_queries(30), self.count_queries(60))
+
+    def test_streaming_loader(self):
+        stream = BytesIO(yaml.safe_dump(self.data, allow_unicode=True, sort_keys=False).encode())
+        self.assertEqual(list(iter_price_list(stream)), list(iter_entries(self.data)))
+
+        stream.seek(0)
+        stats = import_entries(iter_price_list(stream))
+        self.assertEqual(stats['unchanged'], 20)
+
+    def check_parameter_blobs(self, *args):
+        out = StringIO()
+        call_command('check_parameter_blobs', '--batch-size', '7', *args, stdout=out)
+        return out.getvalue()
+
+    def test_check_parameter_blobs(self):
+        self.assertEqual(self.check_parameter_blobs(), 'Checked 20 products\n')
+
+        product_info = ProductInfo.objects.order_by('id')[10]
+        expected = product_info.parameters
+        ProductInfo.objects.filter(id=product_info.id).update(parameters=[['Параметр 1', 'Устаревшее']])
+        with self.assertRaisesMessage(CommandError, '1 of 20 products are out of sync, run with --fix'):
+            self.check_parameter_blobs()
+
+        report = self.check_parameter_blobs('--fix')
+        self.assertEqual(report, f'ProductInfo {product_info.id}: parameters are out of sync\n'
+                                 f'Checked 20 products, fixed 1\n')
+        product_info.refresh_from_db()
+        self.assertEqual(product_info.parameters, expected)
+        self.assertEqual(self.check_parameter_blobs(), 'Checked 20 products\n')
+
+    def test_invalid_price_list(self):
+        with self.assertRaises(ValueError):
+            list(iter_price_list(BytesIO(b'- shop: Feed')))
+        with self.assertRaises(ValueError):
+            import_entries(iter_price_list(BytesIO(b'goods: []')))
+
+
+class ProductInfoReadSerializerTest(TestCase):
+    def test_output_matches_model_serializer(self):
+        import_price_list(make_price_list(20))
+        queryset = ProductInfo.objects.order_by('id')
+
+        self.assertEqual(JsonResponse(ProductInfoReadSerializer(queryset).data, safe=False).content,
+                         JsonResponse(ProductInfoSerializer(queryset.for_catalog(), many=True).data,
+                                      safe=False).content)
+
+
+class FacetsTest(TestCase):
+    def setUp(self):
+        import_price_list(make_price_list(40, categories=2, parameters=2))
+        self.shop = Shop.objects.get()
+        self.category = Category.objects.order_by('id').first()
+
+    def expected(self, product_infos):
+        facets = {}
+        for name, value in ProductParameter.objects.filter(product_info__in=product_infos).values_list(
+                'parameter__name', 'value'):
+            facets.setdefault(name, {}).setdefault(value, 0)
+            facets[name][value] += 1
+        return facets
+
+    def test_refresh_facets(self):
+        ParameterFacet.objects.all().delete()
+        refresh_facets(self.shop)
+        in_category = ProductInfo.objects.filter(product__category=self.category)
+        self.assertEqual(get_facets(self.shop.id, self.category.id), self.expected(in_category))
+        self.assertEqual(get_facets(self.shop.id), self.expected(ProductInfo.objects.all()))
+
+    def test_closed_shop_has_no_facets(self):
+        Shop.objects.update(state=False)
+        self.assertEqual(get_facets(), {})
+
+    def test_filter_by_parameters(self):
+        filters = parse_parameter_filters(QueryDict('param[Параметр 1]=Значение 1&param[Параметр 1]=Значение 2'
+                                                    '&param[Параметр 2]=Значение 3&shop_id=1'))
+        self.assertEqual(filters, {'Параметр 1': ['Значение 1', 'Значение 2'], 'Параметр 2': ['Значение 3']})
+
+        filtered = filter_by_parameters(ProductInfo.objects.all(), filters).distinct()
+        expected = [product_info.id for product_info in ProductInfo.objects.order_by('id')
+                    if dict(product_info.parameters)['Параметр 1'] in ('Значение 1', 'Значение 2')
+                    and dict(product_info.parameters)['Параметр 2'] == 'Значение 3']
+        self.assertTrue(expected)
+        self.assertEqual(sorted(filtered.values_list('id', flat=True)), expected)
+        # counts over the filtered offers only
+        self.assertEqual(get_facets(queryset=filtered), self.expected(filtered))
+
+
+class CatalogCacheTest(BuyerMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = make_price_list(10)
+        import_price_list(self.data)
+        self.shop = Shop.objects.get()
+
+    def get(self, name, params=None, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name), params or {}, HTTP_TOKEN=self.token.key, **headers)
+        return response, len(queries)
+
+    def test_hit_and_miss(self):
+        params = {'shop_id': self.shop.id}
+        response, queries = self.get('product-info', params)
+        self.assertGreater(queries, 0)
+
+        cached, queries = self.get('product-info', params)
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached.content, response.content)
+
+        _, queries = self.get('product-info', {**params, 'category_id': 1})
+        self.assertGreater(queries, 0)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example.com'])
+    def test_links_follow_host(self):
+        params = {'shop_id': self.shop.id, 'page_size': 2}
+        response, _ = self.get('product-info', params)
+        self.assertTrue(response.json()['Next'].startswith('http://testserver/'))
+
+        other, queries = self.get('product-info', params, HTTP_HOST='shop.example.com', secure=True)
+        self.assertGreater(queries, 0)
+        self.assertTrue(other.json()['Next'].startswith('https://shop.example.com/'))
+        self.assertNotEqual(other['ETag'], response['ETag'])
+
+    def test_import_invalidates_cached_responses(self):
+        params = {'shop_id': self.shop.id}
+        response, _ = self.get('product-info', params)
+        self.data['goods'][0]['price'] += 1
+        import_price_list(self.data)
+
+        fresh, queries = self.get('product-info', params)
+        self.assertGreater(queries, 0)
+        self.assertEqual(fresh.json()['Data'][0]['price'], response.json()['Data'][0]['price'] + 1)
+
+    def test_conditional_requests(self):
+        for name in ('categories', 'products-list', 'product-info'):
+            with self.subTest(name=name):
+                response, _ = self.get(name)
+                self.assertEqual(response.status_code, 200)
+
+                not_modified, queries = self.get(name, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual((not_modified.status_code, queries), (304, 0))
+                not_modified, _ = self.get(name, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(not_modified.status_code, 304)
+
+                # another query string is another representation
+                other, _ = self.get(name, {'page_size': 2}, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(other.status_code, 200)
+
+    def test_import_changes_etag(self):
+        response, _ = self.get('products-list')
+        self.data['goods'][0]['quantity'] += 1
+        import_price_list(self.data)
+
+        modified, _ = self.get('products-list', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        data = make_price_list(10)
+        data['goods'][0].update(name='Смартфон Apple iPhone 12', model='apple/iphone-12')
+        data['goods'][1].update(name='Смартфон Samsung Galaxy', model='samsung/galaxy')
+        import_price_list(data)
+        self.iphone, self.galaxy = ProductInfo.objects.filter(external_id__in=(1, 2)).order_by('external_id')
+
+    def assert_search(self):
+        self.assertEqual(sorted(search.search('смартфон', 10)), [self.iphone.id, self.galaxy.id])
+        self.assertEqual(search.search('IPH', 10), [self.iphone.id])
+        self.assertEqual(search.search('смарт galaxy', 10), [self.galaxy.id])
+        self.assertEqual(search.search('смартфон nokia', 10), [])
+        self.assertEqual(len(search.search('смартфон', 1, 1)), 1)
+
+        Shop.objects.update(state=False)
+        self.assertEqual(search.search('смартфон', 10), [])
+
+    def test_fts(self):
+        self.assertTrue(search.use_fts())
+        self.assert_search()
+
+    def test_search_tokens(self):
+        with mock.patch.object(search, '_use_fts', False):
+            search.index_product_infos(ProductInfo.objects.values_list('id', flat=True))
+            self.assert_search()
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('product-search'), {'q': 'iphone'}).json()
+        self.assertEqual([item['id'] for item in response['Data']], [self.iphone.id])
+        self.assertEqual(self.client.get(reverse('product-search'), {'q': ' '}).status_code, 400)
+
+        response = self.client.get(reverse('product-search'), {'q': 'смартфон', 'page_size': 1}).json()
+        self.assertIsNone(response['Previous'])
+        second = self.client.get(response['Next']).json()
+        self.assertEqual(sorted(item['id'] for item in response['Data'] + second['Data']),
+                         [self.iphone.id, self.galaxy.id])
+        self.assertIsNone(second['Next'])
+        self.assertIsNotNone(second['Previous'])
+        self.assertEqual(self.client.get(reverse('product-search'), {'q': 'смартфон', 'page': 'x'}).status_code, 400)
+
+
+class CheckoutTest(BuyerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import_price_list(make_price_list(3))
+        self.product_info = ProductInfo.objects.order_by('id').first()
+
+    def add(self, quantity, product_info=None):
+        return self.client.post(reverse('basket'), {
+            'product_info': (product_info or self.product_info).id,
+            'quantity': quantity,
+        }, HTTP_TOKEN=self.token.key).json()
+
+    def test_checkout_reserves_stock(self):
+        stock = self.product_info.quantity
+        self.add(1)
+        self.add(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('order-checkout'), HTTP_TOKEN=self.token.key).json()
+        # the catalog version is bumped after commit, outside the reservation
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "backend_shop"')])
+
+        self.assertTrue(response['Status'])
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, stock - 2)
+        self.assertFalse(Order.objects.filter(user=self.user, status='basket').exists())
+        self.assertEqual(list(OutgoingEmail.objects.values_list('to', flat=True)), [[self.user.email]])
+
+    def test_checkout_fails_without_stock(self):
+        other = ProductInfo.objects.order_by('id').last()
+        self.add(1, other)
+        self.add(self.product_info.quantity + 1)
+        response = self.client.post(reverse('order-checkout'), HTTP_TOKEN=self.token.key)
+
+        self.assertEqual(response.status_code, 409)
+        quantity = other.quantity
+        other.refresh_from_db()
+        self.assertEqual(other.quantity, quantity)
+        self.assertTrue(Order.objects.filter(user=self.user, status='basket').exists())
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+
+    def test_two_offers_for_one_product(self):
+        ProductInfo.objects.filter(id=self.product_info.id).update(quantity=10)
+        cheap = ProductInfo.objects.get(id=self.product_info.id)
+        expensive = ProductInfo.objects.create(
+            product_id=cheap.product_id, shop_id=cheap.shop_id, external_id=1000, name=cheap.name,
+            quantity=5, price=cheap.price + 800, price_rrc=cheap.price_rrc)
+        # the older offer is the one the catalog would not pick by default
+        self.assertLess(cheap.id, expensive.id)
+        self.add(1, cheap)
+        self.add(2, expensive)
+        self.client.post(reverse('basket-batch'), json.dumps({'items': [{'product_info': cheap.id, 'quantity': 3}]}),
+                         content_type='application/json', HTTP_TOKEN=self.token.key)
+        self.assertEqual(self.client.post(reverse('order-checkout'), HTTP_TOKEN=self.token.key).status_code, 200)
+
+        for offer, quantity in ((cheap, cheap.quantity - 3), (expensive, 3)):
+            offer.refresh_from_db()
+            self.assertEqual(offer.quantity, quantity)
+        order = Order.objects.get(user=self.user)
+        detail = self.client.get(reverse('order-detail', args=[order.id]), HTTP_TOKEN=self.token.key).json()['Data']
+        self.assertEqual(sorted((item['product_info'], item['price'], item['quantity'])
+                                for item in detail['ordered_items']),
+                         [(cheap.id, cheap.price, 3), (expensive.id, expensive.price, 2)])
+        self.assertEqual(detail['total_sum'], cheap.price * 3 + expensive.price * 2)
+
+    def test_removed_offer_falls_back_to_current_one(self):
+        self.add(1)
+        replacement = ProductInfo.objects.create(
+            product_id=self.product_info.product_id, shop_id=self.product_info.shop_id, external_id=1000,
+            name=self.product_info.name, quantity=5, price=self.product_info.price + 1,
+            price_rrc=self.product_info.price_rrc)
+        self.product_info.delete()
+        self.assertEqual(self.client.post(reverse('order-checkout'), HTTP_TOKEN=self.token.key).status_code, 200)
+
+        replacement.refresh_from_db()
+        self.assertEqual(replacement.quantity, 4)
+        item = OrderItem.objects.with_prices().get()
+        self.assertEqual((item.product_info_id, item.price), (replacement.id, replacement.price))
+
+
+class CheckoutCatalogCacheTest(BuyerMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        import_price_list(make_price_list(3))
+        self.product_info = ProductInfo.objects.order_by('id').first()
+
+    def get_quantity(self, response):
+        return next(item['quantity'] for item in response.json()['Data'] if item['id'] == self.product_info.id)
+
+    def test_checkout_invalidates_cached_catalog(self):
+        url = reverse('product-info')
+        params = {'shop_id': self.product_info.shop_id}
+        cached = self.client.get(url, params)
+        self.assertEqual(self.get_quantity(cached), self.product_info.quantity)
+
+        self.client.post(reverse('basket'), {'product_info': self.product_info.id, 'quantity': 2},
+                         HTTP_TOKEN=self.token.key)
+        self.assertEqual(self.client.post(reverse('order-checkout'), HTTP_TOKEN=self.token.key).status_code, 200)
+
+        response = self.client.get(url, params)
+        self.assertEqual(self.get_quantity(response), self.product_info.quantity - 2)
+        self.assertNotEqual(response['ETag'], cached['ETag'])
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=cached['ETag']).status_code, 200)
+
+
+class TokenCacheTest(BuyerMixin, TestCase):
+    def get_basket(self):
+        return self.client.get(reverse('basket'), HTTP_TOKEN=self.token.key)
+
+    def test_warm_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+        # local tier
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+        # shared tier, as seen by another process
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+
+    def test_deleted_token(self):
+        self.assertEqual(self.get_basket().status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.get_basket().status_code, 403)
+        self.assertIsNone(get_token_user(self.token.key))
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.get_basket().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_basket().status_code, 403)
+        self.assertFalse(get_token_user(self.token.key).is_active)
+
+
+class BasketBatchTest(BuyerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import_price_list(make_price_list(60))
+        self.ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+
+    def post(self, items):
+        return self.client.post(reverse('basket-batch'), {'items': items},
+                                content_type='application/json', HTTP_TOKEN=self.token.key)
+
+    def count_queries(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([{'product_info': product_info_id, 'quantity': 2} for product_info_id in ids])
+        self.assertTrue(response.json()['Status'])
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        # warm up the token cache and create the basket
+        self.post([{'product_info': self.ids[0], 'quantity': 1}])
+        self.assertEqual(self.count_queries(self.ids[1:4]), self.count_queries(self.ids[10:40]))
+        # updates of existing lines
+        self.assertEqual(self.count_queries(self.ids[1:4]), self.count_queries(self.ids[10:40]))
+
+    def test_results_per_line(self):
+        self.post([{'product_info': self.ids[0], 'quantity': 1}])
+        response = self.post([
+            {'product_info': self.ids[0], 'quantity': 5},
+            {'product_info': self.ids[1], 'quantity': 1},
+            {'product_info': 0, 'quantity': 1},
+            {'product_info': self.ids[2], 'quantity': 0},
+        ]).json()
+        self.assertFalse(response['Status'])
+        self.assertEqual([item['Status'] for item in response['Items']], [True, True, False, False])
+        self.assertEqual([item.get('Created') for item in response['Items'][:2]], [False, True])
+        self.assertEqual(sorted(OrderItem.objects.filter(order__user=self.user).values_list('quantity', flat=True)),
+                         [1, 5])
+
+    def test_duplicate_lines(self):
+        response = self.post([
+            {'product_info': self.ids[0], 'quantity': 3},
+            {'product_info': self.ids[0], 'quantity': 7},
+        ])
+        self.assertEqual(response.status_code, 200)
+        items = response.json()['Items']
+        self.assertEqual([item['Status'] for item in items], [True, False])
+        self.assertIn('Duplicate', items[1]['Error'])
+        self.assertEqual(list(OrderItem.objects.filter(order__user=self.user).values_list('quantity', flat=True)), [3])
+
+
+class OrderHistoryTest(BuyerMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import_price_list(make_price_list(30))
+        self.product_infos = list(ProductInfo.objects.order_by('id'))
+        # warm up the token cache
+        self.client.get(reverse('order'), HTTP_TOKEN=self.token.key)
+
+    def create_orders(self, count):
+        for n in range(count):
+            order = Order.objects.create(user=self.user, status='new')
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product_id=product_info.product_id, shop_id=product_info.shop_id, quantity=2)
+                for product_info in self.product_infos[n:n + 3])
+
+    def test_totals_in_one_query(self):
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as queries:
+            orders = self.client.get(reverse('order'), HTTP_TOKEN=self.token.key).json()['Data']
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([order['item_count'] for order in orders], [3, 3])
+        self.assertEqual([order['total_sum'] for order in orders],
+                         [sum(2 * product_info.price for product_info in self.product_infos[n:n + 3])
+                          for n in (1, 0)])
+
+        self.create_orders(8)
+        with CaptureQueriesContext(connection) as queries:
+            orders = self.client.get(reverse('order'), HTTP_TOKEN=self.token.key).json()['Data']
+        self.assertEqual(len(orders), 10)
+        self.assertEqual(len(queries), 1)
+
+    def test_pages(self):
+        self.create_orders(5)
+        ids, url, previous = [], reverse('order') + '?page_size=2', []
+        while url:
+            response = self.client.get(url, HTTP_TOKEN=self.token.key).json()
+            ids += [order['id'] for order in response['Data']]
+            previous.append(response['Previous'])
+            url = response['Next']
+        self.assertEqual(ids, list(Order.objects.order_by('-datetime', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(previous), 3)
+        self.assertIsNone(previous[0])
+        self.assertEqual(self.client.get(reverse('order'), {'page_size': 'x'},
+                                         HTTP_TOKEN=self.token.key).status_code, 400)
+
+    def test_detail_line_totals(self):
+        self.create_orders(1)
+        order = Order.objects.get()
+        response = self.client.get(reverse('order-detail', args=[order.id]), HTTP_TOKEN=self.token.key).json()
+        lines = response['Data']['ordered_items']
+        self.assertEqual([line['price'] for line in lines],
+                         [product_info.price for product_info in self.product_infos[:3]])
+        self.assertEqual(sum(line['total'] for line in lines), response['Data']['total_sum'])
+
+    def test_other_users_orders_are_hidden(self):
+        other = User.objects.create_user('other@example.com', 'password', username='other')
+        order = Order.objects.create(user=other, status='new')
+        self.assertEqual(self.client.get(reverse('order-detail', args=[order.id]),
+                                         HTTP_TOKEN=self.token.key).status_code, 404)
+        self.assertEqual(self.client.get(reverse('order'), HTTP_TOKEN=self.token.key).json()['Data'], [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointBudgetTest(TestCase):
+    """
+    Бюджет запросов к БД каждого адреса при sizes[-1] позициях в каталоге,
+    и число запросов не растёт с каталогом. Кэши очищаются перед каждым замером,
+    так что меряется холодный путь. Бюджеты времени проверяет
+    run_load_benchmark --check-budgets
+    """
+    sizes = (5, 50)
+    budgets = {
+        'register': 11,
+        'login': 2,
+        'partner-state-get': 2,
+        'partner-state-post': 5,
+        'partner-update': 2,
+        'categories': 3,
+        'products-list': 4,
+        'product-info': 4,
+        'product-info-filtered': 4,
+    }
+
+    def setUp(self):
+        self.shop_user, self.shop_token = create_user_token('shop@example.com', type='shop', company='Связной')
+        self.buyer, self.buyer_token = create_user_token()
+        self.registered = 0
+
+    def get_requests(self, size):
+        shop = Shop.objects.get(name='Связной')
+        self.registered += 1
+        return {
+            'register': lambda: self.client.post(reverse('register-account'), {
+                'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': f'user{self.registered}@example.com',
+                'username': f'user{self.registered}', 'password': 'Secret-password-42', 'company': 'Shop',
+                'position': 'Buyer'}),
+            'login': lambda: self.client.post(reverse('login-account'), {'username': 'buyer', 'password': 'password'}),
+            'partner-state-get': lambda: self.client.get(reverse('partner-state'), HTTP_TOKEN=self.shop_token.key),
+            'partner-state-post': lambda: self.client.post(reverse('partner-state'), {'state': 'on'},
+                                                           HTTP_TOKEN=self.shop_token.key),
+            'partner-update': lambda: self.client.post(reverse('partner-update'), {
+                'url': 'https://example.com/shop.yaml'}, HTTP_TOKEN=self.shop_token.key),
+            'categories': lambda: self.client.get(reverse('categories')),
+            'products-list': lambda: self.client.get(reverse('products-list'), {'page_size': size},
+                                                     HTTP_TOKEN=self.buyer_token.key),
+            'product-info': lambda: self.client.get(reverse('product-info'), {
+                'shop_id': shop.id, 'page_size': size}),
+            'product-info-filtered': lambda: self.client.get(reverse('product-info'), {
+                'shop_id': shop.id, 'page_size': size, 'param[Параметр 1]': 'Значение 1'}),
+        }
+
+    def measure(self, size):
+        import_price_list(make_price_list(size))
+        measured = {}
+        for name, request in self.get_requests(size).items():
+            clear_caches()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertLess(response.status_code, 400, f'{name}: {response.content[:200]}')
+            measured[name] = len(queries)
+        return measured
+
+    def test_budgets(self):
+        small, large = (self.measure(size) for size in self.sizes)
+        for name, budget in self.budgets.items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(small[name], large[name], 'query count grows with the catalog')
+                self.assertLessEqual(large[name], budget)
+
+
+class RequestTimingTest(TestCase):
+    def setUp(self):
+        import_price_list(make_price_list(10))
+        clear_caches()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('product-info'))
+        timings = response['Server-Timing']
+        self.assertRegex(timings, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('serialize;dur=', timings)
+        self.assertIn('total;dur=', timings)
+
+    def test_slow_request_logs_worst_queries(self):
+        with self.settings(REQUEST_TIMING={**settings.REQUEST_TIMING, 'SLOW_REQUEST': 0, 'WORST_QUERIES': 2}), \
+                self.assertLogs('backend.requests', 'WARNING') as logs:
+            self.client.get(reverse('product-info'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'product-info')
+        self.assertGreater(record['queries'], 2)
+        self.assertEqual(len(record['worst_queries']), 2)
+
+    def test_serialize_excludes_queries(self):
+        def slow_execute(*args):
+            time.sleep(0.05)
+
+        metrics = RequestMetrics(worst_queries=1)
+        token = current_metrics.set(metrics)
+        try:
+            with timing('serialize'):
+                metrics(slow_execute, 'SELECT 1', (), False, {})
+        finally:
+            current_metrics.reset(token)
+        self.assertGreaterEqual(metrics.sql_time, 0.05)
+        self.assertLess(metrics.timings['serialize'], 0.05)
+
+    def test_disabled(self):
+        with self.settings(REQUEST_TIMING={**settings.REQUEST_TIMING, 'ENABLED': False}):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('product-info')))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        clear_caches()
+
+    def get_metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_metrics(self):
+        self.client.get(reverse('categories'))
+        self.client.get(reverse('categories'))
+        self.client.get(reverse('order'))
+        metrics = self.get_metrics()
+        self.assertIn('http_responses_total{status="200",view="categories"} 2', metrics)
+        self.assertIn('http_responses_total{status="403",view="order"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",view="categories",le="+Inf"} 2', metrics)
+        self.assertIn('http_request_duration_seconds_count{method="GET",view="categories"} 2', metrics)
+
+    def test_import_metrics(self):
+        import_feed('https://example.com/shop.yaml', iter_entries(make_price_list(20)),
+                    PriceListDownload(None, False, '', '', ''))
+        metrics = self.get_metrics()
+        self.assertIn('price_import_rows_total{result="inserted",shop="Связной"} 20', metrics)
+        self.assertIn('price_import_duration_seconds_count 1', metrics)
+        self.assertRegex(metrics, r'price_import_rows_per_second{shop="Связной"} [\d.]+')
+
+    def test_processes_are_summed(self):
+        with TemporaryDirectory() as directory, \
+                self.settings(METRICS={**settings.METRICS, 'DIRECTORY': directory}):
+            # another worker process
+            worker = Registry()
+            worker.inc('http_responses_total', {'view': 'categories', 'status': 200}, 5)
+            worker.flush()
+
+            self.client.get(reverse('categories'))
+            metrics = self.get_metrics()
+        self.assertIn('http_responses_total{status="200",view="categories"} 6', metrics)
+
+
+class ProfilerTest(TestCase):
+    def setUp(self):
+        import_price_list(make_price_list(10))
+        self.staff, self.staff_token = create_user_token('staff@example.com', is_staff=True, is_superuser=True)
+        self.buyer, self.buyer_token = create_user_token()
+        clear_caches()
+
+    def test_staff_request_is_profiled(self):
+        response = self.client.get(reverse('product-info'), {'profile': 1}, HTTP_TOKEN=self.staff_token.key)
+        self.assertTrue(response.json()['Status'])
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.view, profile.status), (self.staff, 'product-info', 200))
+        self.assertIn('cumulative', profile.stats)
+
+        self.client.force_login(self.staff)
+        download = self.client.get(reverse('admin:backend_requestprofile_download', args=[profile.id]))
+        self.assertIn(profile.file_name, download['Content-Disposition'])
+        self.assertEqual(download.content, bytes(profile.data))
+
+    def test_stats_instead_of_response(self):
+        response = self.client.get(reverse('categories'), HTTP_TOKEN=self.staff_token.key, HTTP_X_PROFILE='stats')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('function calls', response.content.decode())
+
+    def test_other_users_are_not_profiled(self):
+        response = self.client.get(reverse('product-info'), {'profile': 1}, HTTP_TOKEN=self.buyer_token.key)
+        self.assertNotIn('X-Profile-Id', response)
+        self.client.get(reverse('product-info'), {'profile': 1})
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException('Mail server is down')
+
+
+class EmailOutboxTest(TestCase):
+    def register(self):
+        return self.client.post(reverse('register-account'), {
+            'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': 'ivan@example.com', 'username': 'ivan',
+            'password': 'Secret-password-42', 'company': 'Shop', 'position': 'Buyer',
+        }).json()
+
+    def test_registration_queues_email(self):
+        self.assertTrue(self.register()['Status'])
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to, ['ivan@example.com'])
+
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutgoingEmail.objects.get().state, 'sent')
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='backend.tests.FailingEmailBackend')
+    def test_mail_outage_is_retried_with_backoff(self):
+        self.assertTrue(self.register()['Status'])
+        self.assertEqual(send_queued_emails(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.state, email.attempts), ('queued', 1))
+        self.assertIn('Mail server is down', email.error)
+        # not due again until the backoff has passed
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        with self.settings(EMAIL_OUTBOX={**settings.EMAIL_OUTBOX, 'MAX_ATTEMPTS': 2}):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        self.assertEqual(OutgoingEmail.objects.get().state, 'failed')
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    Поставщик прайс-листов: /ok, /slow, /trickle, /stall, /huge, /huge-unsized, /error, /redirect/<n>
+    """
+    body = b'shop: Feed\ncategories: []\ngoods: []\n'
+
+    def do_GET(self):
+        if self.path.startswith('/redirect/'):
+            hops = int(self.path.rsplit('/', 1)[1])
+            self.send_response(302)
+            self.send_header('Location', f'/redirect/{hops - 1}' if hops else '/ok')
+            self.end_headers()
+        elif self.path == '/error':
+            self.send_error(500)
+        elif self.path == '/huge':
+            self.send_response(200)
+            self.send_header('Content-Length', str(10 ** 9))
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.end_headers()
+            if self.path == '/slow':
+                time.sleep(2)
+            if self.path == '/trickle':
+                # each byte comes within the read timeout, the whole body does not
+                for _ in range(30):
+                    self.wfile.write(b'#')
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            if self.path == '/stall':
+                # part of the body, then silence longer than the whole download may take
+                self.wfile.write(b'#\n')
+                self.wfile.flush()
+                time.sleep(3)
+                return
+            if self.path == '/huge-unsized':
+                for _ in range(64):
+                    self.wfile.write(b'#' * 1024 + b'\n')
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(PRICE_LIST_TIMEOUT=(1, 0.5), PRICE_LIST_MAX_SIZE=16 * 1024, PRICE_LIST_MAX_REDIRECTS=2)
+class PriceListFetchTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        cls.server.daemon_threads = True
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_download(self):
+        download = download_price_list(f'{self.base_url}/redirect/1')
+        parsed = parse_price_list(download.path)
+        try:
+            self.assertEqual(list(iter_parsed_price_list(parsed)), [('shop', 'Feed')])
+        finally:
+            os.remove(download.path)
+            os.remove(parsed)
+
+    def test_limits(self):
+        for path, error in (('/slow', RequestException), ('/huge', PriceListFetchError),
+                            ('/huge-unsized', PriceListFetchError), ('/error', HTTPError),
+                            ('/redirect/2', PriceListFetchError)):
+            with self.subTest(path=path), self.assertRaises(error):
+                download_price_list(f'{self.base_url}{path}')
+
+    def test_max_time(self):
+        started = time.monotonic()
+        with self.assertRaisesMessage(PriceListFetchError, 'longer than 1s'):
+            download_price_list(f'{self.base_url}/trickle', max_time=1)
+        self.assertLess(time.monotonic() - started, 2)
+        with self.assertRaises(PriceListFetchError):
+            download_price_list('file:///etc/passwd')
+
+    def test_max_time_caps_read_timeout(self):
+        started = time.monotonic()
+        with self.assertRaisesMessage(PriceListFetchError, 'longer than 1s'):
+            download_price_list(f'{self.base_url}/stall', timeout=(1, 10), max_time=1)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_concurrent_downloads(self):
+        started = time.monotonic()
+        results = download_price_lists({
+            path: {'url': f'{self.base_url}{path}'} for path in ('/ok', '/slow', '/error', '/huge')
+        }, timeout=(1, 5))
+        try:
+            # /slow does not hold up the others
+            self.assertLess(time.monotonic() - started, 4)
+            self.assertIsInstance(results['/ok'].path, str)
+            self.assertIsInstance(results['/slow'].path, str)
+            self.assertIsInstance(results['/error'], HTTPError)
+            self.assertIsInstance(results['/huge'], PriceListFetchError)
+        finally:
+            for result in results.values():
+                if getattr(result, 'path', None):
+                    os.remove(result.path)
+
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(IMPORT_JOBS={**settings.IMPORT_JOBS, 'LEASE': 60, 'HEARTBEAT': 30, 'MAX_ATTEMPTS': 2})
+class ImportJobTest(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = TemporaryDirectory()
+        name, = write_price_lists(cls.directory.name, [make_price_list(20, shop='Feed')])
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietFileHandler, directory=cls.directory.name))
+        cls.server.daemon_threads = True
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/{name}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        clear_caches()
+        self.user, self.token = create_user_token('shop@example.com', type='shop')
+
+    def enqueue(self):
+        response = self.client.post(reverse('partner-update'), {'url': self.url}, HTTP_TOKEN=self.token.key)
+        return response.json()['Job']
+
+    def get_status(self, job_id):
+        return self.client.get(reverse('partner-update-status', args=[job_id]), HTTP_TOKEN=self.token.key).json()['Data']
+
+    def test_run_job(self):
+        job_id = self.enqueue()
+        job = claim_next_job()
+        self.assertEqual((job.id, job.state, job.attempts), (job_id, 'running', 1))
+        self.assertIsNone(claim_next_job())
+
+        run_import_job(job)
+        data = self.get_status(job_id)
+        self.assertEqual((data['state'], data['inserted'], data['progress']), ('done', 20, None))
+        self.assertEqual(data['shop'], Shop.objects.get(name='Feed').id)
+
+        self.enqueue()
+        self.assertEqual(run_import_job(claim_next_job()).state, 'unchanged')
+
+    def test_progress(self):
+        job_id = self.enqueue()
+        heartbeat = Heartbeat(claim_next_job())
+        heartbeat.stats = {'categories': 1, 'inserted': 7, 'updated': 0, 'deleted': 0, 'unchanged': 3}
+        heartbeat.beat()
+        self.assertEqual(self.get_status(job_id)['progress'],
+                         {'inserted': 7, 'updated': 0, 'deleted': 0, 'unchanged': 3})
+
+    def test_progress_during_import(self):
+        job_id = self.enqueue()
+        job = claim_next_job()
+        paused, resume = Event(), Event()
+        import_entries = tasks.import_entries
+
+        def pausing_import(entries, replace=False, progress=None):
+            def on_progress(importer):
+                progress(importer)
+                if not paused.is_set():
+                    paused.set()
+                    resume.wait(10)
+            return import_entries(entries, replace=replace, batch_size=5, progress=on_progress)
+
+        def work():
+            try:
+                run_import_job(job)
+            finally:
+                connection.close()
+
+        worker = Thread(target=work)
+        with self.settings(IMPORT_JOBS={**settings.IMPORT_JOBS, 'HEARTBEAT': 0.01}), \
+                mock.patch.object(tasks, 'import_entries', pausing_import):
+            worker.start()
+            try:
+                self.assertTrue(paused.wait(10))
+                # the import transaction is open, its lease and counters are not in it
+                deadline = time.monotonic() + 5
+                while self.get_status(job_id)['progress']['inserted'] != 5 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(self.get_status(job_id)['progress']['inserted'], 5)
+                self.assertEqual(tasks.requeue_stale_jobs(), 0)
+            finally:
+                resume.set()
+                worker.join()
+        self.assertEqual(self.get_status(job_id)['state'], 'done')
+
+    def test_stale_job_is_requeued(self):
+        job_id = self.enqueue()
+        claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        later = time.time() + 61
+        with mock.patch.object(tasks.time, 'time', return_value=later):
+            job = claim_next_job()
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+        with mock.patch.object(tasks.time, 'time', return_value=later + 61):
+            self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), ('failed', 'Worker stopped responding'))
+
+    def test_requeued_job_keeps_its_state(self):
+        self.enqueue()
+        job = claim_next_job()
+        ImportJob.objects.update(state='queued')
+        with self.assertLogs('backend.tasks', 'WARNING'):
+            run_import_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.finished_at), ('queued', None))
+
+
+class RefreshPriceListsTest(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.price_lists = [make_price_list(10, shop='Feed 1', seed=1), make_price_list(10, shop='Feed 2', seed=2)]
+        names = write_price_lists(self.directory, self.price_lists)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietFileHandler, directory=self.directory))
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        self.urls = [f'{self.base_url}/{name}' for name in names]
+
+    def refresh(self, *urls):
+        """
+        Итоговый отчёт команды: {ссылка: строка после неё}
+        """
+        out = StringIO()
+        call_command('refresh_price_lists', *urls, '--parse-workers', '2', stdout=out, stderr=StringIO())
+        *lines, total = out.getvalue().split('\n\n')[-1].splitlines()
+        self.assertRegex(total, r'^Total: \d+\.\d\ds$')
+        return dict(line.split(': ', 1) for line in lines)
+
+    def test_changed_and_unchanged_feeds(self):
+        report = self.refresh(*self.urls)
+        for url in self.urls:
+            self.assertRegex(report[url], r'^fetch=\S+s parse=\S+s import=\S+s categories=10 inserted=10 ')
+        self.assertEqual(ProductInfo.objects.count(), 20)
+        self.assertEqual(set(Shop.objects.values_list('url', flat=True)), set(self.urls))
+
+        self.price_lists[0]['goods'][0]['price'] += 1
+        write_price_lists(self.directory, self.price_lists[:1])
+        # the file server compares Last-Modified to the second
+        path = os.path.join(self.directory, 'shop-1.yaml')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+
+        missing = f'{self.base_url}/missing.yaml'
+        report = self.refresh(*self.urls, missing)
+        self.assertIn(' updated=1 ', report[self.urls[0]])
+        self.assertRegex(report[self.urls[1]], r'^fetch=\S+s unchanged$')
+        self.assertIn('404', report[missing])
+        self.assertEqual(ProductInfo.objects.get(shop__name='Feed 1', external_id=1).price,
+                         self.price_lists[0]['goods'][0]['price'])
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    buyers = 8
+
+    def test_last_unit_is_sold_once(self):
+        import_price_list(make_price_list(1))
+        product_info = ProductInfo.objects.get()
+        ProductInfo.objects.filter(id=product_info.id).update(quantity=1)
+
+        tokens = []
+        for i in range(self.buyers):
+            user, token = create_user_token(f'buyer{i}@example.com')
+            order = Order.objects.create(user=user, status='basket')
+            OrderItem.objects.create(order=order, product_id=product_info.product_id, shop_id=product_info.shop_id,
+                                     quantity=1)
+            tokens.append(token.key)
+
+        barrier = Barrier(self.buyers)
+        results = []
+
+        def buy(token):
+            try:
+                barrier.wait()
+                results.append(Client().post(reverse('order-checkout'), HTTP_TOKEN=token).status_code)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=buy, args=(token, )) for token in tokens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [200] + [409] * (self.buyers - 1))
+        self.assertEqual(ProductInfo.objects.get().quantity, 0)
+        self.assertEqual(Order.objects.filter(status='new').count(), 1)
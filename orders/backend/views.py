@@ -1,32 +1,47 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from yaml import load as load_yaml, Loader
-from requests import get
+from django.db import transaction
+from django.db.models import F, Prefetch, Q
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
 from rest_framework.authtoken.models import Token
 
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import NotFound
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-
-
-from backend.models import Shop, Category, Product, ProductInfo, Parameter, \
-    ProductParameter, Order, OrderItem, Contact, ConfirmEmailToken
-
-from backend.signals import new_user_registered, new_order
-from .serializers import UserSerializer, CategorySerializer, ProductInfoSerializer
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+
+
+from backend.models import Shop, Category, ProductInfo, Order, OrderItem, Contact, ConfirmEmailToken, \
+    ImportJob
+
+from backend.signals import new_user_registered
+from .serializers import UserSerializer, CategorySerializer, ProductInfoReadSerializer, ImportJobSerializer, \
+    OrderSerializer, OrderItemSerializer, OrderSummarySerializer, OrderDetailSerializer
+from .tasks import get_job_progress
+from .authentication import CachedTokenAuthentication
+from .pagination import LookaheadPagination, ProductInfoCursorPagination
+from .middleware import timing
+from .metrics import render as render_metrics
+from .cache import CatalogState, bump_catalog_version
+from .search import search
+from .facets import filter_by_parameters, get_facets, parse_parameter_filters
+from .checkout import CheckoutError, checkout, get_basket, update_basket
 
 from rest_framework.authentication import SessionAuthentication
 
 from .models import User, Shop
 
 from distutils.util import strtobool
+import json
+from datetime import datetime, time, timedelta
 
 # Create your views here.
 
@@ -60,13 +75,10 @@ class RegisterAccount(APIView):
                     request.data.update({})
                     user_serializer = UserSerializer(data=request.data)
                     if user_serializer.is_valid():
-                        user = user_serializer.save()
-                        user.set_password(request.data['password'])
-                       
-                        user.save()
-
-                        # Signal. Crashes with 500 error
-                        # new_user_registered.send(sender=self.__class__, user_id=user.id)
+                        # the confirmation email is queued in the same transaction
+                        with transaction.atomic():
+                            user = user_serializer.save(password=make_password(request.data['password']))
+                            new_user_registered.send(sender=self.__class__, user_id=user.id)
 
                         return JsonResponse({'Status': True})
                     else:
@@ -147,19 +159,18 @@ class LoginAccount(APIView):
 
 
 class PartnerState(APIView):
-    authentication_classes = (CsrfExemptSessionAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     """
     Запрещает или разрешает прием заказов
     """
     def post(self, request, *args, **kwargs):
 
-        try:
-            user = Token.objects.get(key=request.headers['token']).user
-        except:
+        if not request.user.is_authenticated:
             return JsonResponse({
                 'Status': False,
                 'Error': 'User which could be associated with that token doesn\'t exist'
             }, status=403)
+        user = request.user
 
         if user.type != 'shop':
             return JsonResponse({
@@ -184,17 +195,17 @@ class PartnerState(APIView):
         shop = Shop.objects.get(name=company_name)
         shop.state = strtobool(request.data['state'])
         shop.save()
+        bump_catalog_version([shop.id])
 
         return JsonResponse({'Status': True})
 
     def get(self, request, *args, **kwargs):
-        try:
-            user = Token.objects.get(key=request.headers['token']).user
-        except:
+        if not request.user.is_authenticated:
             return JsonResponse({
                 'Status': False,
                 'Error': 'User which could be associated with that token doesn\'t exist'
             }, status=403)
+        user = request.user
 
         if user.type != 'shop':
             return JsonResponse({
@@ -212,19 +223,19 @@ class PartnerState(APIView):
 
 
 class PartnerUpdate(APIView):
-    authentication_classes = (CsrfExemptSessionAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     """
-    Класс для обновления прайса от поставщика
+    Класс для обновления прайса от поставщика.
+    Ставит загрузку в очередь, её выполняет команда process_import_jobs
     """
     def post(self, request, *args, **kwargs):
 
-        try:
-            user = Token.objects.get(key=request.headers['token']).user
-        except:
+        if not request.user.is_authenticated:
             return JsonResponse({
                 'Status': False,
                 'Error': 'User which could be associated with that token doesn\'t exist'
             }, status=403)
+        user = request.user
         
         if user.type != 'shop':
             return JsonResponse({
@@ -243,41 +254,50 @@ class PartnerUpdate(APIView):
                     'Error': str(e)
                 })
             else:
-                stream = get(url).content
-
-                data = load_yaml(stream, Loader=Loader)
-
-                shop, _ = Shop.objects.get_or_create(name=data['shop'])
-                for category in data['categories']:
-                    category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                    category_object.shop.add(shop.id)
-                    category_object.save()
-                ProductInfo.objects.filter(shop_id=shop.id).delete()
-                for item in data['goods']:
-                    product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-                    product_info = ProductInfo.objects.create(product_id=product.id,
-                                                              external_id=item['id'],
-                                                              model=item['model'],
-                                                              shop_id=shop.id,
-                                                              name=item['name'],
-                                                              quantity=item['quantity'],
-                                                              price=item['price'],
-                                                              price_rrc=item['price_rrc'])
-
-                    for name, value in item['parameters'].items():
-                        parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                        ProductParameter.objects.create(product_info_id=product_info.id,
-                                                        parameter_id=parameter_object.id,
-                                                        value=value)
+                job = ImportJob.objects.create(user=user, url=url, replace=request.data.get('mode') == 'replace')
 
-                return JsonResponse({'Status': True})
+                return JsonResponse({'Status': True, 'Job': job.id})
 
         return JsonResponse({
             'Status': False,
             'Error': 'Not all required arguments are filled'})
     
 
+class PartnerUpdateStatus(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    Состояние задания на обновление прайса
+    """
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+        user = request.user
+
+        if user.type != 'shop':
+            return JsonResponse({
+                'Status': False,
+                'Error': 'This API is only for shops'
+            }, status=403)
+
+        job = ImportJob.objects.filter(id=job_id, user=user).first()
+        if job is None:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Job not found'
+            }, status=404)
+
+        data = ImportJobSerializer(job).data
+        data['progress'] = get_job_progress(job)
+
+        return JsonResponse({
+            'Status': True,
+            'Data': data
+        })
+
+
 class CategoryView(ListAPIView):
     """
     Список категорий
@@ -285,51 +305,393 @@ class CategoryView(ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def get(self, request, *args, **kwargs):
+        catalog = CatalogState(request)
+        response = catalog.not_modified(request)
+        if response is not None:
+            return response
+        return catalog.add_headers(super().get(request, *args, **kwargs))
+
+
+def paginated_product_infos(view, request, queryset, **extra):
+    """
+    Страница товаров со ссылками на соседние страницы
+    """
+    paginator = ProductInfoCursorPagination()
+    try:
+        # the page comes as rows for the serializer, so it is read only once
+        page = paginator.paginate_queryset(ProductInfoReadSerializer.project(queryset), request, view=view)
+    except NotFound as e:
+        return JsonResponse({
+            'Status': False,
+            'Error': str(e.detail)
+        }, status=404)
+
+    with timing('serialize'):
+        return JsonResponse({
+            'Status': True,
+            'Data': ProductInfoReadSerializer(page).data,
+            'Next': paginator.get_next_link(),
+            'Previous': paginator.get_previous_link(),
+            **extra
+        })
+
 
 class ProductsList(APIView):
-    authentication_classes = (CsrfExemptSessionAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     """
     Получение списка товаров
     """
     def get(self, request, *args, **kwargs):
-        try:
-            user = Token.objects.get(key=request.headers['token']).user
-        except:
+        if not request.user.is_authenticated:
             return JsonResponse({
                 'Status': False,
                 'Error': 'User which could be associated with that token doesn\'t exist'
             }, status=403)
 
+        catalog = CatalogState(request)
+        response = catalog.not_modified(request)
+        if response is not None:
+            return response
+
         products = ProductInfo.objects.all()
-        serializer = ProductInfoSerializer(products, many=True)
 
-        return JsonResponse({
-            'Status': True,
-            'Data': serializer.data
-        })
+        return catalog.add_headers(paginated_product_infos(self, request, products))
 
 
 class ProductInfoView(APIView):
     """
-    Поиск товара
+    Поиск товара.
+    Фильтры по параметрам передаются как param[Цвет]=синий, в ответе
+    возвращается число предложений для каждого значения параметров.
+    Ответы кэшируются до следующего изменения каталога магазина
     """
     def get(self, request, *args, **kwargs):
         query = Q(shop__state=True)
         category_id = request.query_params.get('category_id')
         shop_id = request.query_params.get('shop_id')
 
+        catalog = CatalogState(request, shop_id)
+        response = catalog.not_modified(request) or catalog.get_cached_response()
+        if response is not None:
+            return response
+
         if shop_id:
             query = query & Q(shop_id=shop_id)
         if category_id:
             query = query & Q(product__category_id=category_id)
 
-        queryset = ProductInfo.objects.filter(query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+        queryset = ProductInfo.objects.filter(query)
+        parameter_filters = parse_parameter_filters(request.query_params)
+        if parameter_filters:
+            queryset = filter_by_parameters(queryset, parameter_filters)
+            facets = get_facets(queryset=queryset)
+        else:
+            facets = get_facets(shop_id, category_id)
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        return catalog.cache_response(paginated_product_infos(self, request, queryset.distinct(), Facets=facets))
+
+
+class ProductSearch(APIView):
+    """
+    Полнотекстовый поиск товара по названию, модели и параметрам
+    """
+    max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Search query required'
+            }, status=400)
+
+        try:
+            paginator = LookaheadPagination(request, self.max_page_size)
+        except ValueError:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'page and page_size must be integers'
+            }, status=400)
+
+        ids = paginator.paginate(search(query, paginator.limit, paginator.offset))
+        rows = ProductInfoReadSerializer(ids).get_rows()
+
+        with timing('serialize'):
+            return JsonResponse({
+                'Status': True,
+                'Data': ProductInfoReadSerializer(rows).data,
+                **paginator.get_links()
+            })
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity > 0 else None
+
+
+class BasketView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    Корзина покупателя
+    """
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        basket = get_basket(request.user)
+        items = basket.ordered_items.select_related('product__category')
 
         return JsonResponse({
             'Status': True,
-            'Data': serializer.data
+            'Data': dict(OrderSerializer(basket).data, ordered_items=OrderItemSerializer(items, many=True).data)
+        })
+
+    def post(self, request, *args, **kwargs):
+        """
+        Добавляет товар в корзину: product_info, quantity
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        quantity = parse_quantity(request.data.get('quantity'))
+        product_info_id = request.data.get('product_info')
+        if quantity is None or not str(product_info_id).isdigit():
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Not all required arguments are filled'
+            }, status=400)
+
+        product_info = ProductInfo.objects.filter(id=product_info_id, shop__state=True).first()
+        if product_info is None:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Product not found'
+            }, status=404)
+
+        basket = get_basket(request.user)
+        item, created = OrderItem.objects.get_or_create(order=basket, product_info=product_info,
+                                                        defaults={'product_id': product_info.product_id,
+                                                                  'shop_id': product_info.shop_id,
+                                                                  'quantity': quantity})
+        if not created:
+            OrderItem.objects.filter(id=item.id).update(quantity=F('quantity') + quantity)
+
+        return JsonResponse({'Status': True, 'Item': item.id})
+
+    def put(self, request, *args, **kwargs):
+        """
+        Меняет количество товара в корзине: id позиции, quantity
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        quantity = parse_quantity(request.data.get('quantity'))
+        item_id = request.data.get('id')
+        if quantity is None or not str(item_id).isdigit():
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Not all required arguments are filled'
+            }, status=400)
+
+        updated = OrderItem.objects.filter(id=item_id, order__user=request.user, order__status='basket').update(
+            quantity=quantity)
+
+        return JsonResponse({'Status': bool(updated), 'Updated': updated})
+
+    def delete(self, request, *args, **kwargs):
+        """
+        Удаляет позиции из корзины: items - id через запятую
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        ids = [item_id.strip() for item_id in str(request.data.get('items', '')).split(',')]
+        if not ids or not all(item_id.isdigit() for item_id in ids):
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Not all required arguments are filled'
+            }, status=400)
+
+        deleted, _ = OrderItem.objects.filter(id__in=ids, order__user=request.user, order__status='basket').delete()
+
+        return JsonResponse({'Status': True, 'Deleted': deleted})
+
+
+class BasketBatch(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    Пакетное изменение корзины: items - список {product_info, quantity}.
+    Количество существующих позиций заменяется переданным
+    """
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        items = request.data.get('items')
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except ValueError:
+                items = None
+        if not isinstance(items, list) or not items:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'items must be a non-empty list'
+            }, status=400)
+
+        results = update_basket(get_basket(request.user), items)
+
+        return JsonResponse({
+            'Status': all(result['Status'] for result in results),
+            'Items': results
         })
+
+
+def user_orders(user):
+    """
+    Заказы пользователя, для персонала - все заказы
+    """
+    return Order.objects.all() if user.is_staff else Order.objects.filter(user=user)
+
+
+class OrderView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    История заказов с числом позиций и суммой.
+    Фильтры: status, date_from, date_to (YYYY-MM-DD), для персонала ещё user
+    """
+    max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        orders = user_orders(request.user)
+        status = request.query_params.get('status')
+        orders = orders.filter(status=status) if status else orders.exclude(status='basket')
+        if request.user.is_staff and request.query_params.get('user', '').isdigit():
+            orders = orders.filter(user_id=request.query_params['user'])
+
+        # whole days as datetime bounds, so the (user, status, datetime) index applies
+        for param, lookup, days in (('date_from', 'datetime__gte', 0), ('date_to', 'datetime__lt', 1)):
+            if request.query_params.get(param):
+                try:
+                    date = parse_date(request.query_params[param])
+                except ValueError:
+                    date = None
+                if date is None:
+                    return JsonResponse({
+                        'Status': False,
+                        'Error': f'{param} must be a date in YYYY-MM-DD format'
+                    }, status=400)
+                start = timezone.make_aware(datetime.combine(date + timedelta(days=days), time.min))
+                orders = orders.filter(**{lookup: start})
+
+        try:
+            paginator = LookaheadPagination(request, self.max_page_size)
+        except ValueError:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'page and page_size must be integers'
+            }, status=400)
+
+        orders = orders.with_totals().order_by('-datetime', '-id')
+        orders = paginator.paginate(list(orders[paginator.offset:paginator.offset + paginator.limit]))
+
+        with timing('serialize'):
+            return JsonResponse({
+                'Status': True,
+                'Data': OrderSummarySerializer(orders, many=True).data,
+                **paginator.get_links()
+            })
+
+
+class OrderDetail(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    Заказ с ценами и суммами позиций
+    """
+    def get(self, request, order_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        items = OrderItem.objects.with_prices().select_related('product__category').order_by('id')
+        order = user_orders(request.user).with_totals().prefetch_related(
+            Prefetch('ordered_items', queryset=items)).filter(id=order_id).first()
+        if order is None:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Order not found'
+            }, status=404)
+
+        with timing('serialize'):
+            return JsonResponse({
+                'Status': True,
+                'Data': OrderDetailSerializer(order).data
+            })
+
+
+class OrderCheckout(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    """
+    Оформление заказа из корзины
+    """
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'User which could be associated with that token doesn\'t exist'
+            }, status=403)
+
+        basket = Order.objects.filter(user=request.user, status='basket').first()
+        if basket is None:
+            return JsonResponse({
+                'Status': False,
+                'Error': 'Basket is empty'
+            }, status=400)
+
+        try:
+            checkout(basket)
+        except CheckoutError as e:
+            return JsonResponse({
+                'Status': False,
+                'Error': str(e)
+            }, status=409)
+
+        return JsonResponse({'Status': True, 'Order': basket.id})
+
+
+class MetricsView(APIView):
+    """
+    Метрики в формате Prometheus. Доступ стоит ограничить на уровне сети
+    """
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.MetricsMiddleware',
+    'backend.middleware.RequestTimingMiddleware',
+    'backend.middleware.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +88,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file instead of the shared in-memory database, so that concurrent
+        # test connections wait for locks like in production
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -147,3 +156,95 @@ REST_FRAMEWORK = {
     ),
 }
 
+
+# Per-request SQL and serialization timings, see backend/middleware.py.
+# Requests slower than SLOW_REQUEST seconds are logged with their WORST_QUERIES slowest queries
+REQUEST_TIMING = {
+    'ENABLED': True,
+    'SLOW_REQUEST': 0.5,
+    'WORST_QUERIES': 5,
+}
+
+# Staff can profile a single request with an X-Profile header or ?profile=1
+# (profile=stats returns the TOP cumulative entries instead of the response)
+PROFILER = {
+    'ENABLED': True,
+    'TOP': 30,
+}
+
+# Prometheus metrics served on /metrics, see backend/metrics.py. With several
+# worker processes set DIRECTORY to a directory shared by them and emptied on deploy
+METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': os.environ.get('METRICS_DIR') or None,
+    'FLUSH_INTERVAL': 1,
+}
+
+# Connect and read timeouts for supplier price lists, seconds
+PRICE_LIST_TIMEOUT = (5, 30)
+# Limits of a single price list download, see backend/pricelist.py
+PRICE_LIST_MAX_SIZE = 100 * 1024 * 1024
+PRICE_LIST_MAX_TIME = 300
+PRICE_LIST_MAX_REDIRECTS = 5
+
+# Outgoing email queue drained by the send_queued_emails command, see backend/mail.py.
+# A failed email is retried after BACKOFF * 2 ** (attempts - 1) seconds, at most MAX_BACKOFF
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 6,
+    'BACKOFF': 60,
+    'MAX_BACKOFF': 3600,
+    'LEASE': 300,
+}
+
+# Price list import jobs, see backend/tasks.py. Workers keep the lease and the
+# progress of a running job in CACHE rather than in the database, which the import
+# transaction keeps locked on SQLite. CACHE must be shared by the workers and the
+# web processes: the file cache below works on one host, use memcached or redis
+# across hosts. A running job whose lease has not been renewed for LEASE seconds
+# goes back to the queue, after MAX_ATTEMPTS it fails
+IMPORT_JOBS = {
+    'CACHE': 'import_jobs',
+    'LEASE': 120,
+    'HEARTBEAT': 10,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Token -> user cache used by backend.authentication.CachedTokenAuthentication.
+# Deleting a token or changing a user invalidates this process and CACHE, so with
+# several workers CACHE must be a shared backend (memcached, redis); with LocMem
+# other workers keep a deleted token or a deactivated user for up to SHARED_TTL.
+# The in-process tier is never invalidated remotely and lives LOCAL_TTL seconds
+TOKEN_CACHE = {
+    'CACHE': 'default',
+    'MAX_SIZE': 10000,
+    'LOCAL_TTL': 5,
+    'SHARED_TTL': 30,
+}
+
+# Replace the backends with a shared one (memcached, redis) when running
+# several worker processes, so that catalog invalidation reaches all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    'import_jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('IMPORT_JOBS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'orders-import-jobs'),
+    },
+}
+
+# Cached product/info responses, see backend/cache.py
+CATALOG_CACHE = {
+    'CACHE': 'catalog',
+    'TIMEOUT': 600,
+    'VERSION_TIMEOUT': 5,
+}
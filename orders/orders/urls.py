@@ -15,12 +15,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from backend.views import PartnerUpdate, PartnerState, RegisterAccount, LoginAccount, CategoryView, ProductsList, ProductInfoView
+from backend.views import PartnerUpdate, PartnerUpdateStatus, PartnerState, RegisterAccount, LoginAccount, CategoryView, ProductsList, ProductInfoView, \
+    ProductSearch, BasketView, BasketBatch, OrderView, OrderDetail, OrderCheckout, MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/update/<int:job_id>', PartnerUpdateStatus.as_view(), name='partner-update-status'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
 
     path('user/register', RegisterAccount.as_view(), name='register-account'),
@@ -28,5 +30,13 @@ urlpatterns = [
 
     path('products/list', ProductsList.as_view(), name='products-list'),
     path('product/info', ProductInfoView.as_view(), name='product-info'),
+    path('product/search', ProductSearch.as_view(), name='product-search'),
     path('categories', CategoryView.as_view(), name='categories'),
+
+    path('basket', BasketView.as_view(), name='basket'),
+    path('basket/batch', BasketBatch.as_view(), name='basket-batch'),
+    path('order', OrderView.as_view(), name='order'),
+    path('order/<int:order_id>', OrderDetail.as_view(), name='order-detail'),
+    path('order/checkout', OrderCheckout.as_view(), name='order-checkout'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]